@@ -2,6 +2,7 @@ import socket
 import threading
 import curses
 import json
+import struct
 import sys
 import asyncio
 
@@ -9,6 +10,35 @@ import asyncio
 HOST = "127.0.0.1"
 PORT = 6001
 
+# フレーム形式: 4バイト(ビッグエンディアン)のペイロード長 + ペイロード
+FRAME_HEADER = struct.Struct("!I")
+
+
+def send_frame(client_socket, message):
+    payload = json.dumps(message).encode()
+    client_socket.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def recv_exactly(client_socket, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = client_socket.recv_into(view[received:])
+        if count == 0:
+            return None
+        received += count
+    return bytes(buffer)
+
+
+def recv_frame(client_socket):
+    """Receive one frame payload, or None when the server closed the connection."""
+    header = recv_exactly(client_socket, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    return recv_exactly(client_socket, length)
+
 
 def receive_messages(client_socket, stdscr, messages, room_id, entering_room_msg):
     stdscr.scrollok(True)
@@ -16,7 +46,7 @@ def receive_messages(client_socket, stdscr, messages, room_id, entering_room_msg
     while True:
         try:
             # print("loop")
-            message = client_socket.recv(4096)
+            message = recv_frame(client_socket)
             print("recieved")
             if message:
                 try:
@@ -57,15 +87,22 @@ def receive_messages(client_socket, stdscr, messages, room_id, entering_room_msg
             break
 
 
-async def send_request(action, data, client_socket):
+async def send_request(action, data, client_socket, wait_response=True):
+    """
+    Send a request and return its response.
+    wait_response=False は receive_messages のスレッドの開始後に使う。
+    同じソケットを2つのスレッドで読むとフレームの境界がずれるため、返答は受信スレッドに任せる。
+    """
     host = "127.0.0.1"
     port = 6001
 
     try:
         request = {"action": action, **data}
-        client_socket.sendall(json.dumps(request).encode())
+        send_frame(client_socket, request)
+        if not wait_response:
+            return {"status": "sent"}
 
-        response_data = client_socket.recv(1024)
+        response_data = recv_frame(client_socket)
         response = json.loads(response_data.decode())
         return response
     except Exception as e:
@@ -238,7 +275,9 @@ async def start_client(stdscr):
                 "room_id": room_id,
                 "message": msg_content,
             }
-            message_result = await send_request("add_message", message, client_socket)
+            message_result = await send_request(
+                "add_message", message, client_socket, wait_response=False
+            )
             stdscr.move(curses.LINES - 2, 5)
             stdscr.clrtoeol()
             stdscr.refresh()
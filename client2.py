@@ -1,8 +1,13 @@
 import socket
 import json
+import struct
 import threading
+import zlib
 import sys
 
+# フレーム形式: 4バイト(ビッグエンディアン)のペイロード長 + ペイロード
+FRAME_HEADER = struct.Struct("!I")
+
 
 class ChatClient:
     def __init__(self, host="127.0.0.1", port=6001):
@@ -11,25 +16,117 @@ class ChatClient:
         self.port = port
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.client_socket.connect((self.host, self.port))
+        # バッファ付きリーダーで複数フレームをまとめて受信する
+        self.reader = self.client_socket.makefile("rb")
         self.listening = True  # To control the message listener thread
+        self.listener_running = False
+        # hello で圧縮を交渉した後、サーバーからのフレームを展開する
+        self.decompressor = None
+        # request_id -> [threading.Event, レスポンス]
+        self._waiters = {}
+        self._next_request_id = 0
+        self._lock = threading.Lock()
 
-    def send_request(self, action, data):
-        """Send a request to the chat server."""
-        try:
-            request = {"action": action, **data}
-            self.client_socket.sendall(
-                json.dumps(request).encode()
-            )  # Send request to the server
+    def send_frame(self, message):
+        """Send a single length-prefixed JSON frame."""
+        payload = json.dumps(message).encode()
+        self.client_socket.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+    def recv_frame(self):
+        """Receive a single length-prefixed JSON frame."""
+        header = self.reader.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            raise ConnectionError("Server closed the connection")
+        (length,) = FRAME_HEADER.unpack(header)
+        payload = self.reader.read(length)
+        if len(payload) < length:
+            raise ConnectionError("Server closed the connection")
+        if self.decompressor is not None:
+            # 先頭1バイトが圧縮の有無(0: 無圧縮, 1: zlib)
+            if payload[0] == 1:
+                payload = self.decompressor.decompress(payload[1:])
+            else:
+                payload = payload[1:]
+        return json.loads(payload.decode())
+
+    def _register(self):
+        """Allocate a request_id and a slot for its response."""
+        with self._lock:
+            self._next_request_id += 1
+            request_id = self._next_request_id
+            self._waiters[request_id] = [threading.Event(), None]
+        return request_id
 
-            response_data = self.client_socket.recv(1024)  # Receive response
-            response = json.loads(response_data.decode())
+    def _dispatch(self, frame):
+        """Deliver a response to the request waiting for it, or handle a push message."""
+        request_id = frame.pop("request_id", None)
+        with self._lock:
+            waiter = self._waiters.get(request_id)
+        if waiter is not None:
+            waiter[1] = frame
+            waiter[0].set()
+        elif frame.get("action") == "new_message":
+            self.display_new_message(frame)
 
-            return response
+    def _wait(self, request_id):
+        """Wait for the response to request_id and release its slot."""
+        waiter = self._waiters[request_id]
+        try:
+            if self.listener_running:
+                # 受信は listen_for_messages のスレッドが行い、返答を振り分ける
+                waiter[0].wait()
+            else:
+                while not waiter[0].is_set():
+                    self._dispatch(self.recv_frame())
+            return waiter[1]
+        finally:
+            with self._lock:
+                del self._waiters[request_id]
+
+    def send_request(self, action, data):
+        """Send a request to the chat server and wait for the response with the same request_id."""
+        try:
+            request_id = self._register()
+            self.send_frame({"action": action, "request_id": request_id, **data})
+            return self._wait(request_id)
         except json.JSONDecodeError:
             return {"status": "error", "message": "Invalid response from server"}
         except Exception as e:
             return {"status": "error", "message": str(e)}
 
+    def hello(self, compression=True):
+        """
+        Negotiate the connection format. Call before starting listen_for_messages.
+        param compression: True の場合、サーバーからのフレームをzlibで圧縮してもらう
+        """
+        response = self.send_request(
+            "hello", {"codecs": ["json"], "compression": "zlib" if compression else None}
+        )
+        if response.get("compression") == "zlib" and self.decompressor is None:
+            self.decompressor = zlib.decompressobj()
+        return response
+
+    def send_requests(self, requests):
+        """Pipeline several (action, data) requests and collect the responses in order."""
+        try:
+            request_ids = []
+            payload = bytearray()
+            for action, data in requests:
+                request_id = self._register()
+                request_ids.append(request_id)
+                encoded = json.dumps(
+                    {"action": action, "request_id": request_id, **data}
+                ).encode()
+                payload += FRAME_HEADER.pack(len(encoded)) + encoded
+            self.client_socket.sendall(payload)
+
+            # サーバーは到着順に関係なく返答するため、IDごとに受け取る
+            return [self._wait(request_id) for request_id in request_ids]
+        except json.JSONDecodeError:
+            return [{"status": "error", "message": "Invalid response from server"}]
+        except Exception as e:
+            return [{"status": "error", "message": str(e)}]
+
     def display_new_message(self, response):
         """Display a new message received from the server."""
         print(
@@ -37,24 +134,34 @@ class ChatClient:
         )
 
     def listen_for_messages(self):
-        """Continuously listen for new messages from the server."""
+        """Continuously receive frames, handing responses to waiting requests."""
+        self.listener_running = True
         while self.listening:
             try:
-                response_data = self.client_socket.recv(1024)
-                if response_data:
-                    response = json.loads(response_data.decode())
-                    if response.get("action") == "new_message":
-                        self.display_new_message(response)
+                self._dispatch(self.recv_frame())
             except json.JSONDecodeError:
                 print("Received invalid message format from server.")
             except Exception as e:
-                print(f"Error receiving message: {str(e)}")
+                if self.listening:  # close() による切断は表示しない
+                    print(f"Error receiving message: {str(e)}")
                 self.listening = False  # Stop listening if an error occurs
                 break
+        self.listener_running = False
+        # 返答を待っているリクエストをエラーで終了させる
+        with self._lock:
+            for waiter in self._waiters.values():
+                waiter[1] = {"status": "error", "message": "Connection closed"}
+                waiter[0].set()
 
     def close(self):
         """Close the connection to the server."""
         self.listening = False  # Stop the listener thread
+        # 受信スレッドは read() の間リーダーのロックを持つため、先にソケットを切断して read() を戻す
+        try:
+            self.client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # すでに切断されている
+        self.reader.close()
         self.client_socket.close()
         print("Connection closed.")
 
@@ -1,7 +1,11 @@
 import socket
 import json
+import struct
 import asyncio
 
+# フレーム形式: 4バイト(ビッグエンディアン)のペイロード長 + ペイロード
+FRAME_HEADER = struct.Struct("!I")
+
 class ChatClient:
     def __init__(self, host='127.0.0.1', port=6001):
         self.host = host
@@ -13,6 +17,7 @@ class ChatClient:
         """Connect to the chat server."""
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.client_socket.connect((self.host, self.port))
+        self.reader = self.client_socket.makefile("rb")
 
     async def send_request(self, action, data):
         """Send a request to the chat server."""
@@ -21,12 +26,13 @@ class ChatClient:
             **data  # 'data' を直接リクエストに統合
         }
 
-        # リクエストをJSON文字列にして送信
-        self.client_socket.sendall(json.dumps(request).encode())
+        # リクエストをJSON文字列にして長さ付きフレームで送信
+        payload = json.dumps(request).encode()
+        self.client_socket.sendall(FRAME_HEADER.pack(len(payload)) + payload)
 
         # サーバーからのレスポンスを受信
-        response_data = self.client_socket.recv(1024)
-        response = json.loads(response_data.decode())
+        (length,) = FRAME_HEADER.unpack(self.reader.read(FRAME_HEADER.size))
+        response = json.loads(self.reader.read(length).decode())
         return response
 
     async def add_user(self, username, password):
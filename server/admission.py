@@ -0,0 +1,195 @@
+import time
+from collections import OrderedDict
+
+# セッションごとのレート制限(limited=True のアクション、1秒あたりの回数とバースト)
+DEFAULT_SESSION_RATE = 20.0
+DEFAULT_SESSION_BURST = 40
+# IPアドレスごとのレート制限(すべてのリクエスト)
+DEFAULT_IP_RATE = 1000.0
+DEFAULT_IP_BURST = 2000
+# サーバー全体で同時に処理するリクエストの上限。超えた分は busy を返す
+DEFAULT_MAX_INFLIGHT_TOTAL = 1024
+# 同時接続数の上限(サーバー全体 / IPアドレスごと。None は無制限)
+DEFAULT_MAX_CONNECTIONS = 10000
+DEFAULT_MAX_CONNECTIONS_PER_IP = None
+# レート制限の状態を保持するキーの最大数。超えたら最も長く使われていないキーから捨てる
+DEFAULT_MAX_TRACKED_KEYS = 100000
+
+BUSY = {"status": "busy", "message": "Server is busy, retry later"}
+TOO_MANY_CONNECTIONS = {"status": "busy", "message": "Too many connections"}
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by session ID or IP address.
+    バケットは rate 個/秒で補充され、burst 個まで貯まる。状態は (トークン数, 最終更新時刻) だけで、
+    使われていないキーは LRU で捨てる(捨てられたキーは満杯のバケットから再開する)。
+    """
+
+    def __init__(self, rate, burst, max_keys=DEFAULT_MAX_TRACKED_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def acquire(self, key, cost=1, now=None):
+        """
+        Take cost tokens from the key's bucket.
+        return: 許可した場合は 0、制限した場合はトークンが貯まるまでの秒数
+        """
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = self.burst
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            self._buckets.move_to_end(key)
+
+        if tokens >= cost:
+            self._buckets[key] = (tokens - cost, now)
+            self.allowed += 1
+            return 0
+        self._buckets[key] = (tokens, now)
+        self.limited += 1
+        return (cost - tokens) / self.rate
+
+    def stats(self):
+        return {
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+def rate_limited(retry_after):
+    return {
+        "status": "error",
+        "message": "Rate limit exceeded",
+        "retry_after": round(retry_after, 3),
+    }
+
+
+def client_ip(client):
+    """IP address of a connection, or None (Unix sockets, internal calls)."""
+    address = getattr(client, "address", None)
+    if isinstance(address, tuple):
+        return address[0]
+    return None
+
+
+class AdmissionController:
+    """
+    Decide whether a connection or a request may be served.
+    - 接続: サーバー全体とIPアドレスごとの同時接続数
+    - リクエスト: サーバー全体の同時処理数(超えたら busy で即座に返す)とIPアドレスごとのレート
+    - limited=True のアクション: セッションごとのレート
+    いずれもイベントループのスレッドからのみ呼び出す。
+    """
+
+    def __init__(
+        self,
+        session_rate=DEFAULT_SESSION_RATE,
+        session_burst=DEFAULT_SESSION_BURST,
+        ip_rate=DEFAULT_IP_RATE,
+        ip_burst=DEFAULT_IP_BURST,
+        max_inflight_total=DEFAULT_MAX_INFLIGHT_TOTAL,
+        max_connections=DEFAULT_MAX_CONNECTIONS,
+        max_connections_per_ip=DEFAULT_MAX_CONNECTIONS_PER_IP,
+    ):
+        """
+        rate に None を指定すると、そのレート制限を無効にする
+        """
+        self.sessions = (
+            RateLimiter(session_rate, session_burst) if session_rate else None
+        )
+        self.ips = RateLimiter(ip_rate, ip_burst) if ip_rate else None
+        self.max_inflight_total = max_inflight_total
+        self.max_connections = max_connections
+        self.max_connections_per_ip = max_connections_per_ip
+        self.inflight = 0
+        self.connections = 0
+        self._connections_by_ip = {}
+        self.shed = 0
+        self.refused_connections = 0
+
+    def open_connection(self, client):
+        """Count a new connection. Return False if it must be refused."""
+        ip = client_ip(client)
+        per_ip = self._connections_by_ip.get(ip, 0)
+        if (
+            self.max_connections is not None
+            and self.connections >= self.max_connections
+        ) or (
+            self.max_connections_per_ip is not None
+            and ip is not None
+            and per_ip >= self.max_connections_per_ip
+        ):
+            self.refused_connections += 1
+            return False
+        self.connections += 1
+        self._connections_by_ip[ip] = per_ip + 1
+        return True
+
+    def close_connection(self, client):
+        ip = client_ip(client)
+        self.connections -= 1
+        remaining = self._connections_by_ip.get(ip, 1) - 1
+        if remaining:
+            self._connections_by_ip[ip] = remaining
+        else:
+            self._connections_by_ip.pop(ip, None)
+
+    def begin_request(self, client):
+        """
+        Admit a request before it is routed.
+        return: 受け付けた場合は None(処理後に end_request() を呼ぶ)、拒否した場合は返すレスポンス
+        """
+        if (
+            self.max_inflight_total is not None
+            and self.inflight >= self.max_inflight_total
+        ):
+            self.shed += 1
+            return dict(BUSY)
+        ip = client_ip(client)
+        if self.ips is not None and ip is not None:
+            retry_after = self.ips.acquire(ip)
+            if retry_after:
+                return rate_limited(retry_after)
+        self.inflight += 1
+        return None
+
+    def end_request(self):
+        self.inflight -= 1
+
+    def check_action(self, ctx):
+        """
+        Rate-limit a limited action (called by ActionRegistry after authentication).
+        return: 許可した場合は None、制限した場合は返すレスポンス
+        """
+        if self.sessions is None or not ctx.user_id:
+            return None
+        retry_after = self.sessions.acquire(ctx.get("session_id"))
+        if retry_after:
+            return rate_limited(retry_after)
+        return None
+
+    def stats(self):
+        stats = {
+            "inflight": self.inflight,
+            "max_inflight_total": self.max_inflight_total,
+            "shed": self.shed,
+            "connections": self.connections,
+            "refused_connections": self.refused_connections,
+        }
+        for name, limiter in (("session", self.sessions), ("ip", self.ips)):
+            if limiter is not None:
+                for key, value in limiter.stats().items():
+                    stats[f"{name}_{key}"] = value
+        return stats
@@ -0,0 +1,102 @@
+"""
+Broadcast microbenchmark: per-recipient encoding vs encode-once.
+
+1回のブロードキャストあたりのCPU時間とメモリ確保量を、購読者数ごとに計測する。
+ネットワークへの書き込みは行わず、送信キューに積むまでのコストだけを測る。
+使い方: python bench_broadcast.py --subscribers 10000 --rounds 50
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+from connection import ClientConnection
+from protocol import encode_frame, encode_message
+
+
+class NullTransport:
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def abort(self):
+        pass
+
+
+class NullWriter:
+    """Stand-in for StreamWriter; frames stay in the connection's queue."""
+
+    transport = NullTransport()
+
+    def get_extra_info(self, name, default=None):
+        return ("127.0.0.1", 0)
+
+    def is_closing(self):
+        return False
+
+
+def per_recipient_broadcast(subscribers, message):
+    # 以前の実装: JSON文字列は1回だけ作るが、encode とフレーム化を受信者ごとに行う
+    message_data = json.dumps(message)
+    for client in subscribers:
+        client.enqueue(encode_frame(message_data.encode()))
+
+
+def encode_once_broadcast(subscribers, message):
+    frame = encode_message(message)
+    for client in subscribers:
+        client.enqueue(frame)
+
+
+def measure(broadcast, subscribers, message, rounds):
+    cpu_times = []
+    for _ in range(rounds):
+        started = time.process_time()
+        broadcast(subscribers, message)
+        cpu_times.append(time.process_time() - started)
+        for client in subscribers:
+            client._queue.clear()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    broadcast(subscribers, message)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    for client in subscribers:
+        client._queue.clear()
+
+    stats = after.compare_to(before, "filename")
+    allocated = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    return sum(cpu_times) / len(cpu_times), allocated, blocks
+
+
+async def main(args):
+    subscribers = [
+        ClientConnection(None, NullWriter(), send_queue_size=args.rounds + 1)
+        for _ in range(args.subscribers)
+    ]
+    message = {
+        "action": "new_message",
+        "message": "x" * args.message_size,
+        "room_id": 1,
+        "user_name": "bench_user",
+    }
+
+    print(f"subscribers={args.subscribers} message_size={args.message_size}")
+    print(f"{'strategy':<14} {'cpu ms/bcast':>13} {'alloc KiB':>11} {'blocks':>8}")
+    for name, broadcast in (
+        ("per_recipient", per_recipient_broadcast),
+        ("encode_once", encode_once_broadcast),
+    ):
+        cpu, allocated, blocks = measure(broadcast, subscribers, message, args.rounds)
+        print(f"{name:<14} {cpu * 1000:>13.3f} {allocated / 1024:>11.1f} {blocks:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--message-size", type=int, default=256)
+    asyncio.run(main(parser.parse_args()))
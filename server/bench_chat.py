@@ -0,0 +1,426 @@
+"""
+Load generator and latency benchmark for the chat protocol.
+
+M人の模擬ユーザーがそれぞれ接続・ログインし、ルームを購読して、目標のレートでメッセージを送信する。
+送信予定時刻から、各購読者に new_message が届くまでのレイテンシ(配信レイテンシ)と、
+add_message の応答までのレイテンシを計測し、スループット・パーセンタイル・エラー数を表示する。
+送信は予定時刻に従う(前の送信の完了を待たない)ため、サーバーが詰まった時間もレイテンシに含まれる。
+--connect を指定しない場合は、一時DBを使う ChatServer を別プロセスで起動して計測する。
+使い方: python bench_chat.py --users 50 --rooms 5 --rate 2 --duration 10 --json result.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from protocol import HEADER, encode_frame
+from server import ChatServer
+
+PASSWORD = "bench-password"
+# ログイン(パスワードのハッシュ計算)を同時に行う数
+SETUP_CONCURRENCY = 16
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    """Latency percentiles in milliseconds."""
+    ordered = sorted(latencies)
+    summary = {"count": len(ordered)}
+    for name, fraction in (("p50", 0.50), ("p99", 0.99), ("p999", 0.999)):
+        value = percentile(ordered, fraction)
+        summary[f"{name}_ms"] = None if value is None else value * 1000
+    summary["max_ms"] = ordered[-1] * 1000 if ordered else None
+    return summary
+
+
+def run_server(host, port, db_name, log_level):
+    """Entry point of the server process started when --connect is not given."""
+    # terminate() でも終了処理を行い、パスワードのハッシュ計算用のプロセスも終了させる
+    def interrupt(signum, frame):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, interrupt)
+    server = ChatServer(host=host, port=port, db_name=db_name)
+    server.logger.setLevel(log_level)
+    server.db.logger.setLevel(log_level)
+    try:
+        asyncio.run(server.start())
+    except KeyboardInterrupt:
+        pass
+
+
+async def wait_until_listening(host, port, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            await writer.wait_closed()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"Server on {host}:{port} did not start")
+
+
+class BenchStats:
+    """Counters and latency samples shared by every simulated user."""
+
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        self.errors = {}
+        self.received = 0
+        self.expected = 0
+        self.ack_latencies = []
+        self.delivery_latencies = []
+        # メッセージ本文 -> 送信予定時刻
+        self.scheduled = {}
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class SimulatedUser:
+    """
+    One chat user on its own connection.
+    リクエストには request_id を付けてパイプライン化し、応答とプッシュ通知は受信タスクで振り分ける。
+    """
+
+    def __init__(self, index, host, port, stats):
+        self.index = index
+        self.username = f"bench{index}-{os.getpid()}"
+        self.host = host
+        self.port = port
+        self.stats = stats
+        self.reader = None
+        self.writer = None
+        self.session_id = None
+        self.room_id = None
+        self._waiters = {}
+        self._next_request_id = 0
+        self._receive_task = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self._receive_task = asyncio.create_task(self._receive_loop())
+
+    async def request(self, message):
+        self._next_request_id += 1
+        request_id = self._next_request_id
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[request_id] = future
+        message["request_id"] = request_id
+        self.writer.write(encode_frame(json.dumps(message).encode()))
+        await self.writer.drain()
+        return await future
+
+    async def _receive_loop(self):
+        try:
+            while True:
+                (length,) = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+                frame = json.loads(await self.reader.readexactly(length))
+                received_at = time.perf_counter()
+                waiter = self._waiters.pop(frame.get("request_id"), None)
+                if waiter is not None:
+                    waiter.set_result(frame)
+                elif frame.get("action") == "new_message":
+                    self._on_message(frame, received_at)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for waiter in self._waiters.values():
+                if not waiter.done():
+                    waiter.set_exception(ConnectionError("Connection closed"))
+
+    def _on_message(self, frame, received_at):
+        scheduled = self.stats.scheduled.get(frame.get("message"))
+        if scheduled is None:
+            return  # 他の実行や計測前のメッセージ
+        self.stats.received += 1
+        self.stats.delivery_latencies.append(received_at - scheduled)
+
+    async def setup(self, room_ids):
+        """Register, log in and subscribe to one of the rooms."""
+        await self.connect()
+        await self.request(
+            {"action": "add_user", "username": self.username, "password": PASSWORD}
+        )
+        login = await self.request(
+            {"action": "login", "username": self.username, "password": PASSWORD}
+        )
+        if login.get("status") != "success":
+            raise RuntimeError(f"Login failed for {self.username}: {login}")
+        self.session_id = login["session_id"]
+        self.room_id = room_ids[self.index % len(room_ids)]
+        subscribe = await self.request(
+            {
+                "action": "subscribe",
+                "session_id": self.session_id,
+                "room_id": self.room_id,
+            }
+        )
+        if subscribe.get("status") != "success":
+            raise RuntimeError(f"Subscribe failed for {self.username}: {subscribe}")
+
+    async def send_messages(self, rate, duration, room_sizes):
+        """
+        Send messages on a fixed schedule of `rate` per second for `duration` seconds.
+        応答を待たずに予定時刻ごとに送信し、応答は別タスクで受け取る。
+        """
+        interval = 1.0 / rate
+        # ユーザーごとに開始をずらし、全員が同じ瞬間に送信しないようにする
+        started = time.perf_counter() + interval * (self.index % 97) / 97
+        deadline = started + duration
+        pending = set()
+        sequence = 0
+        scheduled = started
+        while scheduled < deadline:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text = f"{self.username}:{sequence}"
+            self.stats.scheduled[text] = scheduled
+            self.stats.sent += 1
+            self.stats.expected += room_sizes[self.room_id]
+            task = asyncio.create_task(self._send_one(text, scheduled))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            sequence += 1
+            scheduled += interval
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def _send_one(self, text, scheduled):
+        try:
+            response = await self.request(
+                {
+                    "action": "add_message",
+                    "session_id": self.session_id,
+                    "room_id": self.room_id,
+                    "message": text,
+                }
+            )
+        except ConnectionError:
+            self.stats.error("connection")
+            return
+        if response.get("status") == "success":
+            self.stats.acked += 1
+            self.stats.ack_latencies.append(time.perf_counter() - scheduled)
+        else:
+            self.stats.error(response.get("message", "error"))
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        if self._receive_task is not None:
+            await self._receive_task
+
+
+async def create_rooms(host, port, count):
+    """Create the benchmark rooms with a dedicated admin user."""
+    admin = SimulatedUser("admin", host, port, BenchStats())
+    await admin.connect()
+    try:
+        await admin.request(
+            {"action": "add_user", "username": admin.username, "password": PASSWORD}
+        )
+        login = await admin.request(
+            {"action": "login", "username": admin.username, "password": PASSWORD}
+        )
+        if login.get("status") != "success":
+            raise RuntimeError(f"Admin login failed: {login}")
+        room_ids = []
+        for index in range(count):
+            room = await admin.request(
+                {
+                    "action": "create_room",
+                    "session_id": login["session_id"],
+                    "room_name": f"bench-{os.getpid()}-{index}",
+                }
+            )
+            if room.get("status") != "success":
+                raise RuntimeError(f"Room creation failed: {room}")
+            room_ids.append(room["room_id"])
+        return room_ids
+    finally:
+        await admin.close()
+
+
+async def run_benchmark(host, port, args):
+    stats = BenchStats()
+    room_ids = await create_rooms(host, port, args.rooms)
+    users = [SimulatedUser(index, host, port, stats) for index in range(args.users)]
+
+    semaphore = asyncio.Semaphore(SETUP_CONCURRENCY)
+
+    async def setup(user):
+        async with semaphore:
+            await user.setup(room_ids)
+
+    setup_started = time.perf_counter()
+    await asyncio.gather(*(setup(user) for user in users))
+    setup_elapsed = time.perf_counter() - setup_started
+
+    room_sizes = {room_id: 0 for room_id in room_ids}
+    for user in users:
+        room_sizes[user.room_id] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(user.send_messages(args.rate, args.duration, room_sizes) for user in users)
+    )
+    send_elapsed = time.perf_counter() - started
+
+    # 送信が終わったあと、残りの配信が届くのを待つ
+    drain_deadline = time.perf_counter() + args.drain_timeout
+    while stats.received < stats.expected and time.perf_counter() < drain_deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    await asyncio.gather(*(user.close() for user in users))
+    await asyncio.sleep(0.2)  # サーバー側の切断処理を落ち着かせる
+
+    return {
+        "config": {
+            "users": args.users,
+            "rooms": args.rooms,
+            "rate_per_user": args.rate,
+            "duration": args.duration,
+        },
+        "setup_seconds": setup_elapsed,
+        "sent": stats.sent,
+        "acked": stats.acked,
+        "errors": stats.errors,
+        "error_count": sum(stats.errors.values()),
+        "deliveries_expected": stats.expected,
+        "deliveries_received": stats.received,
+        "deliveries_missing": stats.expected - stats.received,
+        "messages_per_second": stats.acked / send_elapsed,
+        "deliveries_per_second": stats.received / elapsed,
+        "ack_latency": summarize(stats.ack_latencies),
+        "delivery_latency": summarize(stats.delivery_latencies),
+    }
+
+
+def format_ms(value):
+    return "-" if value is None else f"{value:.2f}"
+
+
+def print_report(result):
+    config = result["config"]
+    print(
+        f"users={config['users']} rooms={config['rooms']} "
+        f"rate={config['rate_per_user']}/s/user duration={config['duration']}s "
+        f"setup={result['setup_seconds']:.1f}s"
+    )
+    print(
+        f"sent={result['sent']} acked={result['acked']} "
+        f"errors={result['error_count']} "
+        f"deliveries={result['deliveries_received']}/{result['deliveries_expected']}"
+    )
+    print(
+        f"throughput: {result['messages_per_second']:.1f} msgs/s, "
+        f"{result['deliveries_per_second']:.1f} deliveries/s"
+    )
+    print(
+        f"{'latency':<10} {'count':>8} {'p50 ms':>9} {'p99 ms':>9} "
+        f"{'p999 ms':>9} {'max ms':>9}"
+    )
+    for name in ("ack", "delivery"):
+        summary = result[f"{name}_latency"]
+        print(
+            f"{name:<10} {summary['count']:>8} "
+            f"{format_ms(summary['p50_ms']):>9} "
+            f"{format_ms(summary['p99_ms']):>9} "
+            f"{format_ms(summary['p999_ms']):>9} "
+            f"{format_ms(summary['max_ms']):>9}"
+        )
+    for kind, count in sorted(result["errors"].items()):
+        print(f"  error {kind!r}: {count}")
+
+
+async def main(args):
+    if args.connect is not None:
+        host, _, port = args.connect.rpartition(":")
+        return await run_benchmark(host, int(port), args)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # サーバーはDBのスレッドやプロセスプールを持つため、spawn で別プロセスとして起動する
+        context = multiprocessing.get_context("spawn")
+        server = context.Process(
+            target=run_server,
+            args=(
+                args.host,
+                args.port,
+                os.path.join(directory, "bench.db"),
+                args.server_log_level,
+            ),
+            name="bench-chat-server",
+        )
+        server.start()
+        try:
+            await wait_until_listening(args.host, args.port)
+            return await run_benchmark(args.host, args.port, args)
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument(
+        "--rate", type=float, default=2.0, help="messages per second per user"
+    )
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=5.0,
+        help="seconds to wait for outstanding deliveries after sending stops",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6102)
+    parser.add_argument(
+        "--connect",
+        metavar="HOST:PORT",
+        help="benchmark an already running server instead of starting one",
+    )
+    parser.add_argument(
+        "--server-log-level",
+        default="WARNING",
+        choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+        help="log level of the server started by the benchmark",
+    )
+    parser.add_argument(
+        "--json", metavar="PATH", help="write the result as JSON ('-' for stdout)"
+    )
+    args = parser.parse_args()
+
+    result = asyncio.run(main(args))
+    if args.json == "-":
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(result)
+        if args.json is not None:
+            with open(args.json, "w") as f:
+                json.dump(result, f, indent=2)
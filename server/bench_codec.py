@@ -0,0 +1,90 @@
+"""
+Codec benchmark: payload size and encode/decode throughput per wire encoding.
+
+代表的なリクエスト・プッシュ通知・履歴レスポンスについて、コーデックごとの
+エンコード後のサイズと1秒あたりのエンコード・デコード回数を計測する。
+msgpack がインストールされていない場合はJSONのみを計測する。
+使い方: python bench_codec.py --iterations 20000 --page-size 50
+"""
+
+import argparse
+import time
+
+from codec import CODECS
+
+
+def sample_payloads(page_size, message_size):
+    text = "こんにちは hello " * (message_size // 16 + 1)
+    messages = [
+        {
+            "message_id": 100000 + index,
+            "user_id": 1000 + index % 17,
+            "message": text[:message_size],
+            "timestamp": "2024-01-01 12:00:00",
+        }
+        for index in range(page_size)
+    ]
+    return {
+        "add_message": {
+            "action": "add_message",
+            "request_id": 42,
+            "session_id": "0123456789abcdef0123456789abcdef",
+            "room_id": 7,
+            "message": text[:message_size],
+        },
+        "new_message": {
+            "action": "new_message",
+            "message": text[:message_size],
+            "room_id": 7,
+            "user_name": "bench_user",
+        },
+        "history_page": {
+            "status": "success",
+            "messages": messages,
+            "has_more": True,
+            "next_before_id": messages[0]["message_id"],
+            "next_after_id": messages[-1]["message_id"],
+        },
+        "users_in_room": {
+            "status": "success",
+            "user_ids": list(range(1000, 1000 + page_size * 4)),
+        },
+    }
+
+
+def ops_per_second(func, argument, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func(argument)
+    return iterations / (time.perf_counter() - started)
+
+
+def main(args):
+    payloads = sample_payloads(args.page_size, args.message_size)
+    print(f"codecs={','.join(CODECS)} iterations={args.iterations}")
+    print(
+        f"{'payload':<14} {'codec':<8} {'bytes':>8} {'ratio':>6} "
+        f"{'encode/s':>11} {'decode/s':>11}"
+    )
+    for payload_name, payload in payloads.items():
+        baseline = None
+        for codec in CODECS.values():
+            encoded = codec.encode(payload)
+            if codec.decode(encoded) != payload:
+                raise AssertionError(f"{codec.name} does not round-trip {payload_name}")
+            baseline = baseline or len(encoded)
+            encode_rate = ops_per_second(codec.encode, payload, args.iterations)
+            decode_rate = ops_per_second(codec.decode, encoded, args.iterations)
+            print(
+                f"{payload_name:<14} {codec.name:<8} {len(encoded):>8} "
+                f"{len(encoded) / baseline:>6.2f} "
+                f"{encode_rate:>11.0f} {decode_rate:>11.0f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--message-size", type=int, default=64)
+    main(parser.parse_args())
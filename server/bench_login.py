@@ -0,0 +1,108 @@
+"""
+Concurrent login benchmark for the password hashing pool.
+
+ユーザーを作成したあと、指定した並列数でログインを繰り返し、レイテンシの
+パーセンタイルとスループット、その間のイベントループの最大遅延を表示する。
+--legacy を指定すると以前の形式(SHA-256)でユーザーを作成し、初回ログイン時の置き換えも計測する。
+使い方: python bench_login.py --users 200 --logins 1000 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+
+from database import AsyncDatabase
+from monitor import LoopLagMonitor
+from passwords import DEFAULT_HASH_WORKERS
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+async def create_users(db, count, legacy):
+    if legacy:
+        rows = [
+            (f"user{index}", hashlib.sha256(b"password").hexdigest())
+            for index in range(count)
+        ]
+
+        def insert(connection):
+            connection.executemany(
+                "INSERT INTO User (username, password) VALUES (?, ?)", rows
+            )
+            connection.commit()
+
+        await db.executor.write(insert)
+    else:
+        await asyncio.gather(
+            *(db.add_user(f"user{index}", "password") for index in range(count))
+        )
+
+
+async def run_logins(db, users, logins, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def login(index):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await db.login(f"user{index % users}", "password")
+            latencies.append(time.perf_counter() - started)
+            if result["status"] != "success":
+                raise RuntimeError(result["message"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login(index) for index in range(logins)))
+    return sorted(latencies), time.perf_counter() - started
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        db = AsyncDatabase(
+            os.path.join(directory, "bench.db"),
+            hash_workers=args.workers,
+            max_concurrent_hashes=args.workers * 2,
+        )
+        await db.setup_database()
+        await create_users(db, args.users, args.legacy)
+
+        monitor = LoopLagMonitor(interval=0.01)
+        monitor.start()
+        latencies, elapsed = await run_logins(
+            db, args.users, args.logins, args.concurrency
+        )
+        await monitor.stop()
+        db.close()
+
+    print(
+        f"scheme={db.password_hasher.scheme} workers={args.workers} "
+        f"logins={args.logins} concurrency={args.concurrency} legacy={args.legacy}"
+    )
+    print(
+        f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+        f"{'logins/s':>9} {'loop lag ms':>12}"
+    )
+    print(
+        f"{percentile(latencies, 0.50) * 1000:>8.1f} "
+        f"{percentile(latencies, 0.90) * 1000:>8.1f} "
+        f"{percentile(latencies, 0.99) * 1000:>8.1f} "
+        f"{latencies[-1] * 1000:>8.1f} "
+        f"{args.logins / elapsed:>9.1f} "
+        f"{monitor.max_lag_ms:>12.1f}"
+    )
+    print(f"upgraded={db.password_hasher.upgraded}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--logins", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=DEFAULT_HASH_WORKERS)
+    parser.add_argument("--legacy", action="store_true")
+    asyncio.run(main(parser.parse_args()))
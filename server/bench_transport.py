@@ -0,0 +1,208 @@
+"""
+Transport benchmark: legacy sock_accept/sock_recv loop vs asyncio Streams.
+
+接続の受け付け速度(connections/sec)とリクエストの往復レイテンシを比較する。
+使い方: python bench_transport.py --connections 500 --requests 2000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import tempfile
+import time
+
+from codec import JSON
+from protocol import HEADER, FrameDecoder, FrameError, encode_frame
+from server import ChatServer, RECV_BUFFER_SIZE
+
+
+class LegacySocketConnection:
+    """Raw non-blocking socket wrapper matching the old sock_sendall path."""
+
+    # process_request が参照する ClientConnection の属性(hello は送らないため常にJSON・無圧縮)
+    codec = JSON
+    compressor = None
+
+    def __init__(self, sock, loop):
+        self.sock = sock
+        self.loop = loop
+        self.address = sock.getpeername()
+        self.rooms = set()
+
+    async def send(self, frame):
+        await self.loop.sock_sendall(self.sock, frame)
+
+    def close(self):
+        self.sock.close()
+
+
+class LegacyChatServer(ChatServer):
+    """ChatServer with the previous accept loop: listen(5) and one sock_accept at a time."""
+
+    async def start(self):
+        await self.db.setup_database()
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.setblocking(False)
+        server.bind((self.host, self.port))
+        server.listen(5)
+
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                sock, _ = await loop.sock_accept(server)
+                sock.setblocking(False)
+                client = LegacySocketConnection(sock, loop)
+                self.clients.add(client)
+                asyncio.create_task(self.handle_legacy_client(client, loop))
+        finally:
+            server.close()
+
+    async def handle_legacy_client(self, client, loop):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await loop.sock_recv(client.sock, RECV_BUFFER_SIZE)
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    await self.process_request(client, json.loads(frame))
+        except (ConnectionError, FrameError):
+            pass
+        finally:
+            self.remove_client(client)
+            client.close()
+
+
+async def wait_until_listening(host, port, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            await writer.wait_closed()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"Server on {host}:{port} did not start")
+
+
+async def request(reader, writer, message):
+    writer.write(encode_frame(json.dumps(message).encode()))
+    await writer.drain()
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return json.loads(await reader.readexactly(length))
+
+
+async def connection_storm(host, port, connections, timeout):
+    """Open every connection at once and count how many complete a round trip."""
+
+    async def connect_once():
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port), timeout
+            )
+        except (OSError, asyncio.TimeoutError):
+            return None
+        try:
+            await asyncio.wait_for(
+                request(reader, writer, {"action": "get_users_in_room", "room_id": 1}),
+                timeout,
+            )
+            return writer
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            writer.close()
+            return None
+
+    started = time.perf_counter()
+    writers = await asyncio.gather(*(connect_once() for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+
+    accepted = [writer for writer in writers if writer is not None]
+    for writer in accepted:
+        writer.close()
+    return len(accepted), elapsed
+
+
+async def round_trips(host, port, count):
+    reader, writer = await asyncio.open_connection(host, port)
+    latencies = []
+    try:
+        for _ in range(count):
+            started = time.perf_counter()
+            await request(reader, writer, {"action": "get_users_in_room", "room_id": 1})
+            latencies.append(time.perf_counter() - started)
+    finally:
+        writer.close()
+    return latencies
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * fraction))
+    return ordered[index]
+
+
+async def run_case(name, server_class, args, workdir):
+    chat_server = server_class(
+        host=args.host,
+        port=args.port,
+        db_name=os.path.join(workdir, f"{name}.db"),
+    )
+    server_task = asyncio.create_task(chat_server.start())
+    try:
+        await wait_until_listening(args.host, args.port)
+        accepted, storm_elapsed = await connection_storm(
+            args.host, args.port, args.connections, args.timeout
+        )
+        await asyncio.sleep(0.2)  # 切断処理を落ち着かせる
+        latencies = await round_trips(args.host, args.port, args.requests)
+    finally:
+        server_task.cancel()
+        try:
+            await server_task
+        except asyncio.CancelledError:
+            pass
+        await asyncio.sleep(0.2)
+
+    return {
+        "name": name,
+        "accepted": accepted,
+        "connections": args.connections,
+        "accept_rate": accepted / storm_elapsed if storm_elapsed else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        results = [
+            await run_case("legacy", LegacyChatServer, args, workdir),
+            await run_case("streams", ChatServer, args, workdir),
+        ]
+
+    print(
+        f"{'transport':<10} {'accepted':>12} {'conn/sec':>10} {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    for result in results:
+        print(
+            f"{result['name']:<10} "
+            f"{result['accepted']:>5}/{result['connections']:<6} "
+            f"{result['accept_rate']:>10.1f} "
+            f"{result['p50_ms']:>8.3f} "
+            f"{result['p99_ms']:>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6101)
+    parser.add_argument("--connections", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,139 @@
+import asyncio
+import functools
+
+from bus import BusClient
+
+
+class BroadcastBackend:
+    """
+    Interface between ChatServer and the transport that fans messages out.
+    publish() は自分の接続への配信と、他のプロセス・ノードへの転送を担う。
+    """
+
+    def bind(self, deliver, room_updated, logger=None):
+        """
+        param deliver: deliver(room_id, message_data) を返すコルーチン関数。
+            room_id が None の場合は全接続への配信
+        param room_updated: room_updated(room_id, message_id)。他のノードでメッセージが
+            保存されたときに呼ばれる(最新メッセージのキャッシュの破棄に使う)。
+            転送が途切れて更新を取りこぼした可能性がある場合は room_id=None で呼ばれる
+        param logger: 転送の失敗を記録するロガー
+        """
+        self.deliver = deliver
+        self.room_updated = room_updated
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def publish(self, room_id, message_data):
+        raise NotImplementedError
+
+    def subscribe(self, room_id):
+        """Called when the first local connection subscribes to a room."""
+
+    def unsubscribe(self, room_id):
+        """Called when the last local connection leaves a room."""
+
+    def stats(self):
+        return {}
+
+
+class InProcessBackend(BroadcastBackend):
+    """Single-process fan-out: messages only go to this server's connections."""
+
+    async def publish(self, room_id, message_data):
+        await self.deliver(room_id, message_data)
+
+
+class _RemoteBackend(BroadcastBackend):
+    """Deliver locally, then forward through a BusClient connection."""
+
+    def __init__(self, open_connection, logger=None):
+        self.client = BusClient(
+            open_connection, self._on_message, logger, on_connect=self._on_connect
+        )
+
+    def bind(self, deliver, room_updated, logger=None):
+        super().bind(deliver, room_updated, logger)
+        if self.client.logger is None:
+            self.client.logger = logger
+
+    async def start(self):
+        await self.client.connect()
+
+    async def close(self):
+        await self.client.close()
+
+    async def publish(self, room_id, message_data):
+        await self.deliver(room_id, message_data)
+        self.client.publish(self._encode(room_id, message_data))
+
+    def _on_connect(self, reconnected):
+        if reconnected:
+            # 切断中に他のノードで保存されたメッセージは、どのルームのものか分からない
+            self.room_updated(None, None)
+
+    async def _deliver_remote(self, room_id, message_data):
+        message_id = message_data.get("message_id")
+        if room_id is not None and message_id is not None:
+            self.room_updated(room_id, message_id)
+        await self.deliver(room_id, message_data)
+
+    def stats(self):
+        return self.client.stats()
+
+
+class FanoutBusBackend(_RemoteBackend):
+    """
+    Fan-out between worker processes of one host through FanoutHub (bus.py).
+    全メッセージを全ワーカーに転送する。
+    """
+
+    def __init__(self, path, logger=None):
+        super().__init__(functools.partial(asyncio.open_unix_connection, path), logger)
+
+    @staticmethod
+    def _encode(room_id, message_data):
+        return {"room_id": room_id, "message": message_data}
+
+    async def _on_message(self, event):
+        await self._deliver_remote(event["room_id"], event["message"])
+
+
+class BrokerBackend(_RemoteBackend):
+    """
+    Fan-out between chat nodes through the standalone broker (broker.py).
+    ノードはルームごとのトピックを購読し、ブローカーは購読しているノードにだけ転送する。
+    """
+
+    def __init__(self, host, port, logger=None):
+        super().__init__(functools.partial(asyncio.open_connection, host, port), logger)
+        self.topics = set()
+
+    def _on_connect(self, reconnected):
+        super()._on_connect(reconnected)
+        # 接続前や切断中に購読したルームと、再起動したブローカーが忘れた購読を伝える
+        for room_id in self.topics:
+            self.client.publish({"op": "subscribe", "topic": room_id}, False)
+
+    @staticmethod
+    def _encode(room_id, message_data):
+        return {"op": "publish", "topic": room_id, "message": message_data}
+
+    def subscribe(self, room_id):
+        self.topics.add(room_id)
+        self.client.publish({"op": "subscribe", "topic": room_id}, False)
+
+    def unsubscribe(self, room_id):
+        self.topics.discard(room_id)
+        self.client.publish({"op": "unsubscribe", "topic": room_id}, False)
+
+    async def _on_message(self, event):
+        if event["op"] == "invalidate":
+            # 購読していないルームの更新は、キャッシュを破棄するための通知だけが届く
+            self.room_updated(event["topic"], event["message_id"])
+        elif event["op"] == "message":
+            await self._deliver_remote(event["topic"], event["message"])
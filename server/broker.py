@@ -0,0 +1,152 @@
+"""
+Standalone pub/sub broker for running several chat nodes side by side.
+
+各ノード(ChatServer)はTCPで接続し、ローカルに購読者がいるルームのトピックを購読する。
+ノードが publish したメッセージは、そのトピックを購読している他のノードにだけ転送する。
+購読していないノードには最新メッセージのキャッシュを破棄するための小さな通知だけを送る。
+使い方: python broker.py --host 127.0.0.1 --port 6100
+"""
+
+import argparse
+import asyncio
+
+from codec import JSON, CodecError
+from connection import ClientConnection, POLICY_DISCONNECT
+from protocol import FrameDecoder, FrameError, encode_message
+from logs import setup_logger
+
+# ノードごとに溜められる未送信フレーム数。溢れたノードは切断する
+BROKER_QUEUE_SIZE = 65536
+RECV_BUFFER_SIZE = 65536
+
+
+class Broker:
+    """
+    Route published room messages to the nodes that subscribe to the room.
+    ノードごとの購読中のトピックは ClientConnection.rooms に保持する。
+    """
+
+    def __init__(self, host="127.0.0.1", port=6100, logger=None):
+        self.host = host
+        self.port = port
+        self.logger = logger if logger is not None else setup_logger(__name__)
+        self.server = None
+        self.nodes = set()
+        self.topics = {}  # topic -> 購読しているノードの集合
+        self.published = 0
+        self.forwarded = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self.handle_node, self.host, self.port
+        )
+        self.logger.info("Broker started on %s:%s", self.host, self.port)
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for node in list(self.nodes):
+            node.abort()
+
+    async def handle_node(self, reader, writer):
+        node = ClientConnection(
+            reader,
+            writer,
+            send_queue_size=BROKER_QUEUE_SIZE,
+            slow_consumer_policy=POLICY_DISCONNECT,
+        )
+        node.start()
+        self.nodes.add(node)
+        address = writer.get_extra_info("peername")
+        self.logger.info("Node connected: %s", address)
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(RECV_BUFFER_SIZE)
+                if not data:
+                    break
+                for payload in decoder.feed(data):
+                    self.handle_event(node, JSON.decode(payload))
+        except (FrameError, CodecError, KeyError) as e:
+            self.logger.error("Invalid event from node %s: %s", address, e)
+        except ConnectionError as e:
+            self.logger.error("Node connection failed: %s", e)
+        finally:
+            self.remove_node(node)
+            await node.aclose()
+            self.logger.info("Node disconnected: %s", address)
+
+    def handle_event(self, node, event):
+        op = event["op"]
+        if op == "subscribe":
+            self.topics.setdefault(event["topic"], set()).add(node)
+            node.rooms.add(event["topic"])
+        elif op == "unsubscribe":
+            self.unsubscribe(node, event["topic"])
+        elif op == "publish":
+            self.publish(node, event["topic"], event["message"])
+        else:
+            self.logger.error("Unknown broker op: %s", op)
+
+    def unsubscribe(self, node, topic):
+        node.rooms.discard(topic)
+        subscribers = self.topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(node)
+            if not subscribers:
+                del self.topics[topic]
+
+    def remove_node(self, node):
+        self.nodes.discard(node)
+        for topic in list(node.rooms):
+            self.unsubscribe(node, topic)
+
+    def publish(self, sender, topic, message):
+        """
+        Forward a message to every other node subscribed to the topic.
+        param topic: ルームID。None の場合はすべてのノードに送る
+        """
+        self.published += 1
+        subscribers = self.nodes if topic is None else self.topics.get(topic, ())
+        # エンコードは1回だけ行い、同じフレームを各ノードのキューに渡す
+        frame = encode_message({"op": "message", "topic": topic, "message": message})
+        for node in subscribers:
+            if node is not sender:
+                node.enqueue(frame)
+                self.forwarded += 1
+
+        message_id = message.get("message_id")
+        if topic is None or message_id is None:
+            return
+        notice = encode_message(
+            {"op": "invalidate", "topic": topic, "message_id": message_id}
+        )
+        for node in self.nodes:
+            if node is not sender and node not in subscribers:
+                node.enqueue(notice)
+
+    def stats(self):
+        return {
+            "nodes": len(self.nodes),
+            "topics": len(self.topics),
+            "published": self.published,
+            "forwarded": self.forwarded,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the chat pub/sub broker.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6100)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(Broker(args.host, args.port).serve_forever())
+    except KeyboardInterrupt:
+        print("Broker shutting down.")
@@ -0,0 +1,201 @@
+import asyncio
+import os
+
+from codec import JSON
+from connection import ClientConnection, POLICY_DISCONNECT
+from protocol import FrameDecoder, encode_frame, encode_message
+
+# ワーカー間の配信で、1つの接続に溜められる未送信フレーム数
+BUS_QUEUE_SIZE = 65536
+RECV_BUFFER_SIZE = 65536
+# ハブが起動するまで接続を再試行する回数と間隔(秒)
+CONNECT_RETRIES = 50
+CONNECT_RETRY_INTERVAL = 0.1
+# 切断後の再接続の間隔(秒)。失敗するたびに倍にし、上限で止める
+RECONNECT_INITIAL_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5.0
+
+
+class FanoutHub:
+    """
+    Relay between worker processes over a Unix domain socket.
+    ワーカーから届いたフレームを、送信元以外のすべてのワーカーにそのまま転送する。
+    フレームはデコードせずに転送するため、ハブのコストはワーカー数に比例するだけで済む。
+    """
+
+    def __init__(self, path, logger=None):
+        self.path = path
+        self.logger = logger
+        self.server = None
+        self.peers = set()
+        self._handlers = set()
+        self.relayed = 0
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self._handle_peer, self.path)
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for peer in list(self.peers):
+            peer.abort()
+        if self._handlers:
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _handle_peer(self, reader, writer):
+        peer = ClientConnection(
+            reader,
+            writer,
+            send_queue_size=BUS_QUEUE_SIZE,
+            slow_consumer_policy=POLICY_DISCONNECT,
+        )
+        peer.start()
+        self.peers.add(peer)
+        self._handlers.add(asyncio.current_task())
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(RECV_BUFFER_SIZE)
+                if not data:
+                    break
+                for payload in decoder.feed(data):
+                    frame = encode_frame(payload)
+                    for other in self.peers:
+                        if other is not peer:
+                            other.enqueue(frame)
+                    self.relayed += 1
+        except Exception as e:
+            if self.logger is not None:
+                self.logger.error("Fan-out bus peer failed: %s", e)
+        finally:
+            self.peers.discard(peer)
+            await peer.aclose()
+            self._handlers.discard(asyncio.current_task())
+
+
+class BusClient:
+    """
+    A node's connection to the FanoutHub or the broker.
+    publish() はキューに積むだけで待たない。他のノードから届いたメッセージは on_message に渡す。
+    接続が切れた場合(ハブやブローカーの再起動、遅いワーカーとしての切断)は間隔を空けて再接続し、
+    そのたびに on_connect を呼ぶ。切断中に publish() したメッセージは捨てる。
+    """
+
+    def __init__(self, open_connection, on_message, logger=None, on_connect=None):
+        """
+        param open_connection: (reader, writer) を返すコルーチン関数
+            例: functools.partial(asyncio.open_unix_connection, path)
+        param on_message: on_message(message) を返すコルーチン関数
+        param on_connect: on_connect(reconnected)。接続するたびに、最初の publish() より前に呼ばれる
+            (購読の再送などに使う)
+        """
+        self.open_connection = open_connection
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.logger = logger
+        self.connection = None
+        self._task = None
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.reconnects = 0
+
+    async def connect(self):
+        for attempt in range(CONNECT_RETRIES):
+            try:
+                reader, writer = await self.open_connection()
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if attempt == CONNECT_RETRIES - 1:
+                    raise
+                await asyncio.sleep(CONNECT_RETRY_INTERVAL)
+        self._attach(reader, writer, reconnected=False)
+        self._task = asyncio.create_task(self._run(reader))
+
+    def _attach(self, reader, writer, reconnected):
+        self.connection = ClientConnection(
+            reader, writer, send_queue_size=BUS_QUEUE_SIZE
+        )
+        self.connection.start()
+        if self.on_connect is not None:
+            self.on_connect(reconnected)
+
+    async def _run(self, reader):
+        """Read until the connection drops, then reconnect with backoff, forever."""
+        while True:
+            await self._read_loop(reader)
+            connection, self.connection = self.connection, None
+            await connection.aclose()
+            if self.logger is not None:
+                self.logger.error("Disconnected from fan-out bus, reconnecting")
+            reader = await self._reconnect()
+
+    async def _reconnect(self):
+        delay = RECONNECT_INITIAL_DELAY
+        attempts = 0
+        while True:
+            await asyncio.sleep(delay)
+            attempts += 1
+            try:
+                reader, writer = await self.open_connection()
+            except OSError as e:
+                if self.logger is not None:
+                    self.logger.debug("Reconnect to fan-out bus failed: %s", e)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            self.reconnects += 1
+            if self.logger is not None:
+                self.logger.info(
+                    "Reconnected to fan-out bus after %s attempt(s)", attempts
+                )
+            self._attach(reader, writer, reconnected=True)
+            return reader
+
+    def publish(self, message, droppable=True):
+        """
+        Queue a message for the hub or broker.
+        param droppable: キューが一杯のときに捨ててよいか(購読の変更などは False)
+        """
+        if self.connection is None:
+            self.dropped += 1
+            return
+        self.connection.enqueue(encode_message(message), droppable)
+        self.published += 1
+
+    async def _read_loop(self, reader):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(RECV_BUFFER_SIZE)
+                if not data:
+                    break
+                for payload in decoder.feed(data):
+                    self.received += 1
+                    await self.on_message(JSON.decode(payload))
+        except Exception as e:
+            if self.logger is not None:
+                self.logger.error("Fan-out bus connection failed: %s", e)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.connection is not None:
+            await self.connection.aclose()
+
+    def stats(self):
+        return {
+            "connected": int(self.connection is not None),
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+        }
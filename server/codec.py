@@ -0,0 +1,71 @@
+import json
+
+try:
+    import msgpack
+except ImportError:  # msgpack は任意。未インストールの場合はJSONのみを提供する
+    msgpack = None
+
+
+class CodecError(ValueError):
+    """Raised when a payload cannot be decoded by the connection's codec."""
+
+
+class JsonCodec:
+    """UTF-8 JSON. Every client understands it, so it is the default before negotiation."""
+
+    name = "json"
+    label = "JSON"
+
+    def __init__(self):
+        # 区切りの空白を省いて、サイズとエンコードのコストを少しでも減らす
+        self._encoder = json.JSONEncoder(separators=(",", ":"))
+
+    def encode(self, message):
+        return self._encoder.encode(message).encode()
+
+    def decode(self, payload):
+        try:
+            return json.loads(payload)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise CodecError(str(e)) from e
+
+
+class MsgpackCodec:
+    """MessagePack: a compact binary encoding with a C implementation."""
+
+    name = "msgpack"
+    label = "MessagePack"
+
+    def encode(self, message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, payload):
+        try:
+            return msgpack.unpackb(payload, raw=False)
+        except Exception as e:
+            raise CodecError(str(e)) from e
+
+
+JSON = JsonCodec()
+
+# name -> codec。hello で交渉できるコーデックの一覧
+CODECS = {JSON.name: JSON}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def register_codec(codec):
+    """Make a codec with name/label/encode/decode available for negotiation."""
+    CODECS[codec.name] = codec
+
+
+def negotiate(preferred):
+    """
+    Pick the first codec in the client's preference list that the server supports.
+    return: コーデック。共通のものがない場合はJSON
+    """
+    for name in preferred or ():
+        codec = CODECS.get(name)
+        if codec is not None:
+            return codec
+    return JSON
@@ -0,0 +1,82 @@
+import zlib
+
+from protocol import HEADER
+
+# この長さ(バイト)未満のペイロードは圧縮せずに送る
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# 圧縮を交渉した接続では、ペイロードの先頭1バイトで圧縮の有無を示す
+FLAG_RAW = 0
+FLAG_ZLIB = 1
+
+COMPRESSIONS = ("zlib",)
+
+
+class FrameCompressor:
+    """
+    Per-connection zlib stream for server-to-client frames.
+    圧縮コンテキストは接続の間ずっと保持するため、以前のフレームの内容が辞書として効く。
+    各フレームは Z_SYNC_FLUSH で区切るので、クライアントは届いた順に1フレームずつ展開できる。
+    """
+
+    def __init__(
+        self, threshold=DEFAULT_COMPRESSION_THRESHOLD, level=DEFAULT_COMPRESSION_LEVEL
+    ):
+        self.threshold = threshold
+        self._compressor = zlib.compressobj(level)
+        self.raw_frames = 0
+        self.compressed_frames = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def compress_frames(self, data):
+        """
+        Rewrite one or more length-prefixed frames into the negotiated compressed format.
+        フレームは送信する順に渡すこと(圧縮ストリームの順序がクライアントの展開順と一致する必要がある)
+        """
+        output = []
+        offset = 0
+        with memoryview(data) as view:
+            while offset < len(data):
+                (length,) = HEADER.unpack_from(data, offset)
+                start = offset + HEADER.size
+                payload = view[start : start + length]
+                offset = start + length
+
+                self.bytes_in += length
+                if length < self.threshold:
+                    body = bytes((FLAG_RAW,)) + payload
+                    self.raw_frames += 1
+                else:
+                    body = (
+                        bytes((FLAG_ZLIB,))
+                        + self._compressor.compress(payload)
+                        + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+                    )
+                    self.compressed_frames += 1
+                self.bytes_out += len(body) - 1
+                output.append(HEADER.pack(len(body)) + body)
+        return b"".join(output)
+
+    def stats(self):
+        return {
+            "raw_frames": self.raw_frames,
+            "compressed_frames": self.compressed_frames,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else 1.0,
+        }
+
+
+class FrameDecompressor:
+    """Client-side counterpart of FrameCompressor."""
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj()
+
+    def decompress(self, payload):
+        """Return the original payload of a frame received after compression was negotiated."""
+        if payload[0] == FLAG_ZLIB:
+            return self._decompressor.decompress(payload[1:])
+        return payload[1:]
@@ -0,0 +1,219 @@
+import asyncio
+from collections import deque
+
+from codec import JSON
+
+# 書き込みバッファの水位(バイト)。high を超えると drain() で送信側を待たせ、low まで下がると再開する
+DEFAULT_WRITE_BUFFER_HIGH = 256 * 1024
+DEFAULT_WRITE_BUFFER_LOW = 64 * 1024
+
+# 接続ごとの送信キューに溜められるフレーム数
+DEFAULT_SEND_QUEUE_SIZE = 1024
+# 切断時に未送信フレームの書き出しを待つ最大秒数
+DEFAULT_FLUSH_TIMEOUT = 1.0
+# coalesce ポリシーで1つにまとめられる未送信データの上限(バイト)
+DEFAULT_COALESCE_LIMIT = 1024 * 1024
+
+# 送信キューが一杯になった(受信の遅い)クライアントへの対応
+POLICY_DROP_OLDEST = "drop_oldest"  # 最も古いプッシュ通知を捨てる
+POLICY_DISCONNECT = "disconnect"  # 接続を切断する
+POLICY_COALESCE = "coalesce"  # 未送信フレームを1つのバッファにまとめる
+SLOW_CONSUMER_POLICIES = (POLICY_DROP_OLDEST, POLICY_DISCONNECT, POLICY_COALESCE)
+
+
+class ClientConnection:
+    """
+    A connected client backed by an asyncio stream pair.
+    送信はすべて接続ごとのキューを経由し、専用のライタータスクが書き込む。
+    そのため遅いクライアントがいても、ブロードキャストや他の接続は待たされない。
+    """
+
+    def __init__(
+        self,
+        reader,
+        writer,
+        write_buffer_high=DEFAULT_WRITE_BUFFER_HIGH,
+        write_buffer_low=DEFAULT_WRITE_BUFFER_LOW,
+        send_queue_size=DEFAULT_SEND_QUEUE_SIZE,
+        slow_consumer_policy=POLICY_DROP_OLDEST,
+        coalesce_limit=DEFAULT_COALESCE_LIMIT,
+    ):
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {slow_consumer_policy}")
+
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info("peername")
+        self.rooms = set()  # この接続が購読しているルームID
+        self.codec = JSON  # hello で交渉するまではJSON
+        self.compressor = None  # hello で圧縮を交渉した場合の FrameCompressor
+        writer.transport.set_write_buffer_limits(
+            high=write_buffer_high, low=write_buffer_low
+        )
+
+        self.send_queue_size = send_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.coalesce_limit = coalesce_limit
+        # (frame, droppable, compress) の組。レスポンスは droppable=False で捨てない
+        # compress のフレームは書き込む直前に、送信順に圧縮する
+        self._queue = deque()
+        self._queue_ready = asyncio.Event()
+        self._queue_drained = asyncio.Event()
+        self._queue_drained.set()
+        self._writer_task = None
+        self._closed = False
+
+        # 送信キューの統計
+        self.peak_queue_depth = 0
+        self.dropped_frames = 0
+        self.coalesced_frames = 0
+        self.disconnected_slow = False
+
+    @property
+    def closed(self):
+        return self._closed or self.writer.is_closing()
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    def start(self):
+        """Start the writer task that drains the send queue."""
+        self._writer_task = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, frame, droppable=True):
+        """
+        Queue an encoded frame without waiting for it to be written.
+        param droppable: キューが一杯のときにポリシーに従って捨ててよいフレームか
+        return: キューに積めた場合は True
+        """
+        if self.closed:
+            return False
+
+        if droppable and len(self._queue) >= self.send_queue_size:
+            if not self._handle_full_queue():
+                return False
+
+        self._queue.append((frame, droppable, self.compressor is not None))
+        if len(self._queue) > self.peak_queue_depth:
+            self.peak_queue_depth = len(self._queue)
+        self._queue_drained.clear()
+        self._queue_ready.set()
+        return True
+
+    def _handle_full_queue(self):
+        """Apply the slow consumer policy. Return False if the new frame must be discarded."""
+        if self.slow_consumer_policy == POLICY_DISCONNECT:
+            self.disconnected_slow = True
+            self.abort()
+            return False
+
+        if self.slow_consumer_policy == POLICY_COALESCE:
+            pending = sum(len(frame) for frame, _, _ in self._queue)
+            if pending > self.coalesce_limit:
+                self.disconnected_slow = True
+                self.abort()
+                return False
+            # まとめる時点でキュー内のフレームは送信順に並んでいるため、ここで圧縮してよい
+            merged = b"".join(self._prepare(entry) for entry in self._queue)
+            self.coalesced_frames += len(self._queue) - 1
+            self._queue.clear()
+            self._queue.append((merged, False, False))
+            return True
+
+        # drop_oldest: 最も古い捨ててよいフレームを削除する
+        for index, (_, droppable, _) in enumerate(self._queue):
+            if droppable:
+                del self._queue[index]
+                self.dropped_frames += 1
+                return True
+        self.dropped_frames += 1
+        return False
+
+    def set_compressor(self, compressor):
+        """Compress frames queued from now on. Frames already queued are sent as they are."""
+        self.compressor = compressor
+
+    def _prepare(self, entry):
+        frame, _, compress = entry
+        return self.compressor.compress_frames(frame) if compress else frame
+
+    async def send(self, frame):
+        """Queue a frame that must not be dropped, waiting while this client's queue is full."""
+        if self.closed:
+            raise ConnectionResetError("Connection is closed")
+        self.enqueue(frame, droppable=False)
+        # 自分の送信キューが溢れている間は、この接続のリクエスト処理だけを待たせる
+        while len(self._queue) >= self.send_queue_size and not self.closed:
+            await self._queue_drained.wait()
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                if not self._queue:
+                    self._queue_drained.set()
+                    self._queue_ready.clear()
+                    await self._queue_ready.wait()
+                    continue
+
+                # 溜まっているフレームをまとめて書き込む
+                frames = [self._prepare(entry) for entry in self._queue]
+                self._queue.clear()
+                self._queue_drained.set()
+                self.writer.writelines(frames)
+                await self.writer.drain()
+        except ConnectionError:
+            self.abort()
+        finally:
+            self._queue_drained.set()
+
+    def abort(self):
+        """Close immediately, discarding anything still queued."""
+        self._closed = True
+        self._queue.clear()
+        self._queue_ready.set()
+        self._queue_drained.set()
+        self.writer.transport.abort()
+
+    def close(self):
+        self._closed = True
+        self._queue_ready.set()
+        if not self.writer.is_closing():
+            self.writer.close()
+
+    async def aclose(self, flush_timeout=DEFAULT_FLUSH_TIMEOUT):
+        """Flush queued frames, stop the writer task and close the stream."""
+        if self._writer_task is not None and not self.closed:
+            # ライタータスクに残りを書き出させてから停止する
+            try:
+                await asyncio.wait_for(self._flush(), flush_timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.close()
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+        await self.wait_closed()
+
+    async def _flush(self):
+        while self._queue and not self.closed:
+            await self._queue_drained.wait()
+
+    async def wait_closed(self):
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    def queue_stats(self):
+        return {
+            "address": self.address,
+            "queue_depth": len(self._queue),
+            "peak_queue_depth": self.peak_queue_depth,
+            "dropped_frames": self.dropped_frames,
+            "coalesced_frames": self.coalesced_frames,
+            "compression": self.compressor.stats() if self.compressor else None,
+        }
@@ -1,48 +1,123 @@
 import sqlite3
-import asyncio
-import hashlib
-from logging import getLogger, DEBUG, INFO
-import colorlog
+import time
+from logs import setup_logger
+from cache import LRUCache
+from db_executor import DatabaseExecutor, DEFAULT_READER_THREADS
+from write_batcher import WriteBatcher, DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_DELAY
+from passwords import (
+    PasswordHasher,
+    DEFAULT_HASH_WORKERS,
+    DEFAULT_MAX_CONCURRENT_HASHES,
+)
+from history_cache import (
+    RecentMessageCache,
+    DEFAULT_MAX_BYTES,
+    DEFAULT_MESSAGES_PER_ROOM,
+)
+
+# user_id -> username のキャッシュに保持する最大件数
+USERNAME_CACHE_SIZE = 10000
+
+# メッセージ履歴のページサイズ
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# タイムスタンプはCURRENT_TIMESTAMPと同じ形式(UTC)でアプリ側から渡し、キャッシュと揃える
+INSERT_MESSAGE_QUERY = """
+    INSERT INTO Message (user_id, room_id, message, timestamp)
+    VALUES (?, ?, ?, ?);
+"""
+
+UPSERT_SESSION_QUERY = """
+    INSERT INTO Session (session_id, user_id, expires_at) VALUES (?, ?, ?)
+    ON CONFLICT(session_id) DO UPDATE SET expires_at = excluded.expires_at;
+"""
 
-LOG_DATE_FORMAT = "%H:%M:%S"
-LOG_FORMAT = "%(log_color)s[%(asctime)s:%(levelname)s-%(name)s] %(message)s"
-LOG_LEVEL = INFO
 
+class AsyncDatabase:
+    def __init__(
+        self,
+        db_name,
+        username_cache_size=USERNAME_CACHE_SIZE,
+        reader_threads=DEFAULT_READER_THREADS,
+        pragmas=None,
+        message_batch_size=DEFAULT_MAX_BATCH_SIZE,
+        message_batch_delay=DEFAULT_MAX_DELAY,
+        recent_messages_per_room=DEFAULT_MESSAGES_PER_ROOM,
+        recent_messages_max_bytes=DEFAULT_MAX_BYTES,
+        hash_workers=DEFAULT_HASH_WORKERS,
+        max_concurrent_hashes=DEFAULT_MAX_CONCURRENT_HASHES,
+    ):
+        """
+        param reader_threads: 読み込み専用接続を持つスレッドの数
+        param pragmas: 既定のPRAGMA(synchronous, cache_size, mmap_size など)を上書きする辞書
+        param message_batch_size: メッセージ保存を1トランザクションにまとめる最大件数
+        param message_batch_delay: メッセージ保存がコミットを待つ最大秒数
+        param recent_messages_per_room: ルームごとにメモリに保持する最新メッセージ数
+        param recent_messages_max_bytes: 最新メッセージのキャッシュ全体のメモリ上限の目安
+        param hash_workers: パスワードのハッシュ計算を行うプロセス数
+        param max_concurrent_hashes: ハッシュ計算を同時に依頼する上限
+        """
+        self.db_name = db_name
+        # SQLiteの処理はすべてこのエグゼキュータ経由で実行し、イベントループをブロックしない
+        self.executor = DatabaseExecutor(db_name, reader_threads, pragmas)
+        # 同時に届いたメッセージの保存をまとめてコミットする(fsyncを1回に抑える)
+        self.message_batcher = WriteBatcher(
+            self.executor,
+            self._insert_messages,
+            max_batch_size=message_batch_size,
+            max_delay=message_batch_delay,
+        )
+        # セッションの保存・延長もまとめてコミットする(ログインが集中したときの書き込みを抑える)
+        self.session_batcher = WriteBatcher(
+            self.executor,
+            self._upsert_sessions,
+            max_batch_size=message_batch_size,
+            max_delay=message_batch_delay,
+        )
+        # ログイン・ユーザー追加時に埋め、ユーザー更新時に無効化する
+        self.username_cache = LRUCache(username_cache_size)
+        # ルームごとの最新メッセージ。保存成功時に追加し、最新ページの取得に使う
+        self.recent_messages = RecentMessageCache(
+            recent_messages_per_room, recent_messages_max_bytes
+        )
+        # パスワードのハッシュ計算は専用のプロセスプールで行う
+        self.password_hasher = PasswordHasher(hash_workers, max_concurrent_hashes)
+        self.logger = setup_logger(__name__)
 
-def setup_logger():
-    handler = colorlog.StreamHandler()
-    formatter = colorlog.ColoredFormatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
-    handler.setFormatter(formatter)
+    async def _read(self, func):
+        """Run func(connection) on the reader pool with a read-only connection."""
+        return await self.executor.read(func)
 
-    logger = getLogger(__name__)
-    logger.addHandler(handler)
-    logger.setLevel(LOG_LEVEL)
-    return logger
+    async def _write(self, func):
+        """Run func(connection) on the single writer thread with the writer connection."""
+        return await self.executor.write(func)
 
+    async def flush(self):
+        """Commit writes that are still waiting in a batch window."""
+        await self.message_batcher.flush()
+        await self.session_batcher.flush()
 
-class AsyncDatabase:
-    def __init__(self, db_name):
-        self.db_name = db_name
-        self.connection = sqlite3.connect(db_name, check_same_thread=False)
-        self.connection.row_factory = sqlite3.Row  # Allows accessing columns by name
-        self.logger = setup_logger()
+    def close(self):
+        """Stop the database threads and close their connections."""
+        self.executor.shutdown()
+        self.password_hasher.shutdown()
 
     async def execute_async(self, query, params=None):
         """Execute a query asynchronously using cursor."""
-        loop = asyncio.get_running_loop()
 
-        def execute_query():
+        def execute_query(connection):
             try:
-                cursor = self.connection.cursor()
+                cursor = connection.cursor()
                 cursor.execute(query, params or ())
-                self.connection.commit()
+                connection.commit()
                 cursor.close()
                 return {"status": "success"}
             except Exception as e:
                 return {"status": "error", "message": str(e)}
 
         # Run the database operation asynchronously
-        return await loop.run_in_executor(None, execute_query)
+        return await self._write(execute_query)
 
     async def setup_database(self):
         """Initialize database schema."""
@@ -75,6 +150,17 @@ class AsyncDatabase:
                 FOREIGN KEY(user_id) REFERENCES User(user_id),
                 FOREIGN KEY(room_id) REFERENCES Room(room_id)
             );""",
+            """CREATE TABLE IF NOT EXISTS Session (
+                session_id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                FOREIGN KEY(user_id) REFERENCES User(user_id)
+            );""",
+            """CREATE INDEX IF NOT EXISTS idx_session_expires
+                ON Session(expires_at);""",
+            # ルームごとの履歴をキーセットでページングするための複合インデックス
+            """CREATE INDEX IF NOT EXISTS idx_message_room_message
+                ON Message(room_id, message_id);""",
         ]
         for query in queries:
             result = await self.execute_async(query)
@@ -86,98 +172,201 @@ class AsyncDatabase:
         """Login a user asynchronously."""
         query = "SELECT user_id, password FROM User WHERE username = ?"
 
-        def authenticate():
+        def fetch_credentials(connection):
             try:
-                cursor = self.connection.cursor()
+                cursor = connection.cursor()
                 cursor.execute(query, (username,))
                 row = cursor.fetchone()
                 cursor.close()
-
-                if not row:
-                    return {
-                        "status": "error",
-                        "message": "Invalid username or password",
-                    }
-
-                user_id, stored_password = row
-
-                hashed_password = hashlib.sha256(password.encode()).hexdigest()
-
-                if hashed_password == stored_password:
-                    return {"status": "success", "user_id": user_id}
-                else:
-                    return {
-                        "status": "error",
-                        "message": "Invalid username or password",
-                    }
+                return {"status": "success", "row": row}
             except Exception as e:
                 return {"status": "error", "message": str(e)}
 
-        return await asyncio.get_running_loop().run_in_executor(None, authenticate)
+        result = await self._read(fetch_credentials)
+        if result["status"] == "error":
+            return result
+        if not result["row"]:
+            # ユーザーが存在する場合と同じだけ待ってから、同じエラーを返す
+            await self.password_hasher.verify_dummy(password)
+            return {"status": "error", "message": "Invalid username or password"}
+
+        user_id, stored_password = result["row"]
+        matched, outdated = await self.password_hasher.verify(
+            password, stored_password
+        )
+        if not matched:
+            return {"status": "error", "message": "Invalid username or password"}
+
+        # 以前の形式(SHA-256)のハッシュは、平文が手元にあるこの時点で新しい形式に置き換える
+        if outdated:
+            upgrade_result = await self._set_password(user_id, password)
+            if upgrade_result["status"] == "success":
+                self.password_hasher.upgraded += 1
+            else:
+                self.logger.error(
+                    "Error upgrading password hash: %s", upgrade_result["message"]
+                )
+
+        # キャッシュはイベントループのスレッドからのみ更新する
+        self.username_cache.put(user_id, username)
+        return {"status": "success", "user_id": user_id}
 
     async def add_user(self, username, password):
         """Add a new user asynchronously."""
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
+        hashed_password = await self.password_hasher.hash(password)
         query = f"INSERT INTO User (username, password) VALUES (?, ?)"
         params = (username, hashed_password)
 
-        loop = asyncio.get_running_loop()
-
-        def execute_and_fetch_lastrowid():
+        def execute_and_fetch_lastrowid(connection):
             try:
-                cursor = self.connection.cursor()
+                cursor = connection.cursor()
                 cursor.execute(query, params)
-                self.connection.commit()
+                connection.commit()
                 user_id = cursor.lastrowid  # Fetch the last inserted row ID
                 cursor.close()
-                self.logger.info(f"New user {username} added with ID: {user_id}")
+                self.logger.info("New user %s added with ID: %s", username, user_id)
                 return {"status": "success", "user_id": user_id}
             except sqlite3.IntegrityError:
-                self.logger.error(f"Username: {username} already exists")
+                self.logger.error("Username: %s already exists", username)
                 return {"status": "error", "message": "Username already exists"}
             except Exception as e:
-                self.logger.error(f"Error adding user: {e}")
+                self.logger.error("Error adding user: %s", e)
                 return {"status": "error", "message": str(e)}
 
-        return await loop.run_in_executor(None, execute_and_fetch_lastrowid)
+        result = await self._write(execute_and_fetch_lastrowid)
+        if result["status"] == "success":
+            self.username_cache.put(result["user_id"], username)
+        return result
 
     async def update_user_async(self, user_id, new_password):
         """Update user's password asynchronously."""
-        hashed_password = hashlib.sha256(new_password.encode()).hexdigest()
+        result = await self._set_password(user_id, new_password)
+        if result["status"] == "success":
+            self.username_cache.invalidate(user_id)
+        return result
+
+    async def _set_password(self, user_id, password):
+        """Store a freshly hashed password for a user."""
+        hashed_password = await self.password_hasher.hash(password)
         query = "UPDATE User SET password = ? WHERE user_id = ?"
         params = (hashed_password, user_id)
+
+        def execute_and_return_status(connection):
+            try:
+                cursor = connection.cursor()
+                cursor.execute(query, params)
+                connection.commit()
+                cursor.close()
+                return {"status": "success"}
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
+
+        return await self._write(execute_and_return_status)
+
+    async def save_message_async(self, user_id, room_id, message):
+        """Save a new message asynchronously, group-committed with concurrent saves."""
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        result = await self.message_batcher.submit(
+            (user_id, room_id, message, timestamp)
+        )
+        if result["status"] == "success":
+            self.recent_messages.append(
+                room_id,
+                {
+                    "message_id": result["message_id"],
+                    "user_id": user_id,
+                    "message": message,
+                    "timestamp": timestamp,
+                },
+            )
+        return result
+
+    @staticmethod
+    def _insert_messages(connection, rows):
+        """
+        Insert a batch of messages in one transaction on the writer thread.
+        return: rows と同じ順序の結果のリスト
+        """
+        cursor = connection.cursor()
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, params)
-            self.connection.commit()
+            cursor.executemany(INSERT_MESSAGE_QUERY, rows)
+            last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+            connection.commit()
+            # 単一の書き込み接続・1トランザクション内なので、IDは連番で割り当てられる
+            first_id = last_id - len(rows) + 1
+            return [
+                {"status": "success", "message_id": first_id + index}
+                for index in range(len(rows))
+            ]
+        except Exception:
+            # sqlite3.Error 以外(範囲外の整数による OverflowError など)でも、途中までの挿入を取り消す
+            connection.rollback()
+        finally:
             cursor.close()
-            return {"status": "success"}
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
 
-    async def save_message_async(self, user_id, room_id, message):
-        """Save a new message asynchronously."""
-        query = """
-            INSERT INTO Message (user_id, room_id, message)
-            VALUES (?, ?, ?);
+        # まとめての挿入に失敗した場合は1件ずつ挿入し、失敗した行だけをエラーにする
+        results = []
+        cursor = connection.cursor()
+        for row in rows:
+            try:
+                cursor.execute(INSERT_MESSAGE_QUERY, row)
+                results.append({"status": "success", "message_id": cursor.lastrowid})
+            except sqlite3.IntegrityError:
+                results.append(
+                    {"status": "error", "message": "Invalid user_id or room_id"}
+                )
+            except Exception as e:
+                results.append({"status": "error", "message": str(e)})
+        connection.commit()
+        cursor.close()
+        return results
+
+    async def load_session(self, session_id):
+        """
+        Fetch a persisted session.
+        return: session は (user_id, expires_at)。存在しない場合は None
         """
-        params = (user_id, room_id, message)
+        query = "SELECT user_id, expires_at FROM Session WHERE session_id = ?"
 
-        def execute_and_return_message_id():
+        def fetch_session(connection):
             try:
-                cursor = self.connection.cursor()
-                cursor.execute(query, params)
-                self.connection.commit()
-                message_id = cursor.lastrowid
+                cursor = connection.cursor()
+                cursor.execute(query, (session_id,))
+                row = cursor.fetchone()
                 cursor.close()
-                return {"status": "success", "message_id": message_id}
-            except sqlite3.IntegrityError:
-                return {"status": "error", "message": "Invalid user_id or room_id"}
+                return {"status": "success", "session": tuple(row) if row else None}
             except Exception as e:
                 return {"status": "error", "message": str(e)}
 
-        return await asyncio.get_running_loop().run_in_executor(
-            None, execute_and_return_message_id
+        return await self._read(fetch_session)
+
+    async def save_session_async(self, session_id, user_id, expires_at):
+        """Insert a session or extend its expiry, group-committed with other saves."""
+        return await self.session_batcher.submit((session_id, user_id, expires_at))
+
+    @staticmethod
+    def _upsert_sessions(connection, rows):
+        cursor = connection.cursor()
+        try:
+            cursor.executemany(UPSERT_SESSION_QUERY, rows)
+            connection.commit()
+            return [{"status": "success"}] * len(rows)
+        except Exception as e:
+            connection.rollback()
+            return [{"status": "error", "message": str(e)}] * len(rows)
+        finally:
+            cursor.close()
+
+    async def delete_session_async(self, session_id):
+        """Delete a persisted session."""
+        return await self.execute_async(
+            "DELETE FROM Session WHERE session_id = ?", (session_id,)
+        )
+
+    async def delete_expired_sessions_async(self, now):
+        """Delete persisted sessions whose expiry has passed."""
+        return await self.execute_async(
+            "DELETE FROM Session WHERE expires_at <= ?", (now,)
         )
 
     async def get_rooms_by_user(self, user_id):
@@ -186,29 +375,33 @@ class AsyncDatabase:
                    FROM RoomUser
                    INNER JOIN Room ON RoomUser.room_id = Room.room_id
                    WHERE RoomUser.user_id = ?;"""
-        try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (user_id,))
-            rooms = cursor.fetchall()
-            cursor.close()
-            room_list = [
-                {"room_id": room[0], "room_name": room[1], "created_at": room[2]}
-                for room in rooms
-            ]
-            return {"status": "success", "rooms": room_list}
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
+
+        def fetch_rooms(connection):
+            try:
+                cursor = connection.cursor()
+                cursor.execute(query, (user_id,))
+                rooms = cursor.fetchall()
+                cursor.close()
+                room_list = [
+                    {"room_id": room[0], "room_name": room[1], "created_at": room[2]}
+                    for room in rooms
+                ]
+                return {"status": "success", "rooms": room_list}
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
+
+        return await self._read(fetch_rooms)
 
     async def create_room_async(self, room_name):
         """Create a new chat room asynchronously."""
         query = "INSERT INTO Room (room_name) VALUES (?)"
         params = (room_name,)
 
-        def execute_and_return_room_id():
+        def execute_and_return_room_id(connection):
             try:
-                cursor = self.connection.cursor()
+                cursor = connection.cursor()
                 cursor.execute(query, params)
-                self.connection.commit()
+                connection.commit()
                 room_id = cursor.lastrowid
                 cursor.close()
                 return {"status": "success", "room_id": room_id}
@@ -217,17 +410,104 @@ class AsyncDatabase:
             except Exception as e:
                 return {"status": "error", "message": str(e)}
 
-        return await asyncio.get_running_loop().run_in_executor(
-            None, execute_and_return_room_id
+        return await self._write(execute_and_return_room_id)
+
+    async def get_messages_by_room(
+        self, room_id, before_id=None, after_id=None, limit=None
+    ):
+        """
+        Retrieve messages for a specific room asynchronously.
+        before_id / after_id / limit のいずれかを指定するとページング取得になる。
+        param before_id: このIDより古いメッセージを新しい順に最大 limit 件取得する
+        param after_id: このIDより新しいメッセージを古い順に最大 limit 件取得する
+        return: ページング時は has_more と次ページ用の next_before_id / next_after_id を含む
+        """
+        if before_id is None and after_id is None and limit is not None:
+            return await self._get_latest_messages(room_id, limit)
+        if before_id is not None or after_id is not None:
+            return await self._get_messages_page(room_id, before_id, after_id, limit)
+
+        query = "SELECT message_id, user_id, message, timestamp FROM Message WHERE room_id = ? ORDER BY message_id ASC"
+
+        def fetch_messages(connection):
+            try:
+                cursor = connection.cursor()
+                cursor.execute(query, (room_id,))
+                messages = [
+                    {
+                        "message_id": row[0],
+                        "user_id": row[1],
+                        "message": row[2],
+                        "timestamp": row[3],
+                    }
+                    for row in cursor.fetchall()
+                ]
+                cursor.close()
+                return {"status": "success", "messages": messages}
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
+
+        return await self._read(fetch_messages)
+
+    async def _get_latest_messages(self, room_id, limit):
+        """Newest page of a room, served from the in-memory ring buffer when possible."""
+        limit = self._page_limit(limit)
+        cached = self.recent_messages.latest(room_id, limit)
+        if cached is not None:
+            return cached
+        if limit > self.recent_messages.messages_per_room:
+            return await self._get_messages_page(room_id, None, None, limit)
+
+        # バッファ1つ分を読み込んで登録し、以降の最新ページ取得はメモリから返す
+        page = await self._get_messages_page(
+            room_id, None, None, self.recent_messages.messages_per_room
+        )
+        if page["status"] == "success" and self.recent_messages.seed(
+            room_id, page["messages"], page["has_more"]
+        ):
+            return self.recent_messages.latest(room_id, limit)
+        return await self._get_messages_page(room_id, None, None, limit)
+
+    @staticmethod
+    def _page_limit(limit):
+        return DEFAULT_PAGE_SIZE if limit is None else max(1, min(limit, MAX_PAGE_SIZE))
+
+    async def _get_messages_page(self, room_id, before_id, after_id, limit):
+        """Keyset-paginated history backed by idx_message_room_message."""
+        limit = self._page_limit(limit)
+
+        conditions = ["room_id = ?"]
+        params = [room_id]
+        if before_id is not None:
+            conditions.append("message_id < ?")
+            params.append(before_id)
+        if after_id is not None:
+            conditions.append("message_id > ?")
+            params.append(after_id)
+        # after_id のみ指定された場合は古い方から、それ以外は最新から遡って取得する
+        forward = after_id is not None and before_id is None
+        order = "ASC" if forward else "DESC"
+        query = (
+            "SELECT message_id, user_id, message, timestamp FROM Message "
+            f"WHERE {' AND '.join(conditions)} "
+            f"ORDER BY message_id {order} LIMIT ?"
         )
+        # 1件多く取得して、続きがあるかどうかを判定する
+        params.append(limit + 1)
 
-    async def get_messages_by_room(self, room_id):
-        """Retrieve all messages for a specific room asynchronously."""
-        query = "SELECT message_id, user_id, message, timestamp FROM Message WHERE room_id = ? ORDER BY timestamp ASC"
+        def fetch_page(connection):
+            try:
+                cursor = connection.cursor()
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                cursor.close()
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
 
-        try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (room_id,))
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            if not forward:
+                rows.reverse()
             messages = [
                 {
                     "message_id": row[0],
@@ -235,12 +515,17 @@ class AsyncDatabase:
                     "message": row[2],
                     "timestamp": row[3],
                 }
-                for row in cursor.fetchall()
+                for row in rows
             ]
-            cursor.close()
-            return {"status": "success", "messages": messages}
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
+            return {
+                "status": "success",
+                "messages": messages,
+                "has_more": has_more,
+                "next_before_id": messages[0]["message_id"] if messages else before_id,
+                "next_after_id": messages[-1]["message_id"] if messages else after_id,
+            }
+
+        return await self._read(fetch_page)
 
     async def add_user_to_room(self, user_id, room_id):
         """Add a user to a specific room."""
@@ -250,87 +535,102 @@ class AsyncDatabase:
         """
         params = (user_id, room_id)
 
-        def execute_and_return_status():
+        def execute_and_return_status(connection):
             try:
-                cursor = self.connection.cursor()
+                cursor = connection.cursor()
                 cursor.execute(query, params)
-                self.connection.commit()
+                connection.commit()
                 cursor.close()
                 return {"status": "success"}
             except Exception as e:
                 return {"status": "error", "message": str(e)}
 
-        return await asyncio.get_running_loop().run_in_executor(
-            None, execute_and_return_status
-        )
+        return await self._write(execute_and_return_status)
 
     async def remove_user_from_room(self, user_id, room_id):
         """Remove a user from a specific room."""
         query = "DELETE FROM RoomUser WHERE user_id = ? AND room_id = ?"
         params = (user_id, room_id)
 
-        def execute_and_return_status():
+        def execute_and_return_status(connection):
             try:
-                cursor = self.connection.cursor()
+                cursor = connection.cursor()
                 cursor.execute(query, params)
-                self.connection.commit()
+                connection.commit()
                 cursor.close()
                 return {"status": "success"}
             except Exception as e:
                 return {"status": "error", "message": str(e)}
 
-        return await asyncio.get_running_loop().run_in_executor(
-            None, execute_and_return_status
-        )
+        return await self._write(execute_and_return_status)
 
     async def get_users_in_room(self, room_id):
         """Retrieve all users in a specific room."""
         query = """
             SELECT user_id FROM RoomUser WHERE room_id = ?
         """
-        try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (room_id,))
-            user_ids = [row[0] for row in cursor.fetchall()]
-            cursor.close()
-            return {"status": "success", "user_ids": user_ids}
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
+
+        def fetch_user_ids(connection):
+            try:
+                cursor = connection.cursor()
+                cursor.execute(query, (room_id,))
+                user_ids = [row[0] for row in cursor.fetchall()]
+                cursor.close()
+                return {"status": "success", "user_ids": user_ids}
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
+
+        return await self._read(fetch_user_ids)
 
     async def get_room_id_by_name(self, room_name):
         """
         Retrieve the room ID for a given room name.
         """
-        try:
-            query = "SELECT room_id FROM Room WHERE room_name = ?"
-            cursor = self.connection.cursor()
-            cursor.execute(query, (room_name,))
-            result = cursor.fetchone()
-            cursor.close()
-            if result:
-                self.logger.debug(f"Found room ID: {result[0]}")
-                return {"status": "success", "room_id": result[0]}
-            else:
-                self.logger.debug("Room not found")
-                return {"status": "error", "message": "Room not found"}
-        except Exception as e:
-            self.logger.error(f"Error fetching room ID: {str(e)}")
-            return {"status": "error", "message": str(e)}
+        query = "SELECT room_id FROM Room WHERE room_name = ?"
+
+        def fetch_room_id(connection):
+            try:
+                cursor = connection.cursor()
+                cursor.execute(query, (room_name,))
+                result = cursor.fetchone()
+                cursor.close()
+                if result:
+                    self.logger.debug("Found room ID: %s", result[0])
+                    return {"status": "success", "room_id": result[0]}
+                else:
+                    self.logger.debug("Room not found")
+                    return {"status": "error", "message": "Room not found"}
+            except Exception as e:
+                self.logger.error("Error fetching room ID: %s", e)
+                return {"status": "error", "message": str(e)}
+
+        return await self._read(fetch_room_id)
 
     async def get_username_by_user_id(self, user_id):
-        """Fetch the username by user ID."""
+        """Fetch the username by user ID, answering from the cache when possible."""
+        username = self.username_cache.get(user_id)
+        if username is not None:
+            return {"status": "success", "username": username}
+
         query = "SELECT username FROM User WHERE user_id = ?"
-        try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (user_id,))
-            result = cursor.fetchone()
-            cursor.close()
-            self.logger.debug(f"Found username: {result}")
-            if result:
-                username = result[0]
-                return {"status": "success", "username": username}
-            else:
-                username = None
-                return {"status": "success", "username": username}
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
+
+        def fetch_username(connection):
+            try:
+                cursor = connection.cursor()
+                cursor.execute(query, (user_id,))
+                result = cursor.fetchone()
+                cursor.close()
+                self.logger.debug("Found username: %s", result)
+                if result:
+                    username = result[0]
+                    return {"status": "success", "username": username}
+                else:
+                    username = None
+                    return {"status": "success", "username": username}
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
+
+        result = await self._read(fetch_username)
+        if result.get("username") is not None:
+            self.username_cache.put(user_id, result["username"])
+        return result
@@ -0,0 +1,98 @@
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+# 読み込み専用クエリを実行するスレッド数
+DEFAULT_READER_THREADS = 4
+
+# 接続ごとに設定するPRAGMA。journal_mode は書き込み用接続でのみ設定する
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # 負の値はKiB単位 (約16MB)
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,
+}
+
+
+class DatabaseExecutor:
+    """
+    Dedicated threads and connections for SQLite work.
+    書き込みは単一のスレッドと専用の接続で直列に実行し、読み込みはスレッドごとの
+    読み込み専用接続を持つスレッドプールで並行に実行する。
+    WALモードにより、読み込みは書き込み中のトランザクションを待たない。
+    """
+
+    def __init__(self, db_name, reader_threads=DEFAULT_READER_THREADS, pragmas=None):
+        self.db_name = db_name
+        self.reader_threads = reader_threads
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        self._writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="db-writer"
+        )
+        # インメモリDBは接続間で共有できないため、読み込みも書き込みスレッドで行う
+        self._readers = None
+        if db_name != ":memory:":
+            self._readers = ThreadPoolExecutor(
+                max_workers=reader_threads, thread_name_prefix="db-reader"
+            )
+
+        # 先に書き込み用接続を開き、DBファイルの作成とWALへの切り替えを済ませておく
+        self._writer.submit(self._thread_connection, False).result()
+
+    def _open(self, readonly):
+        if readonly:
+            uri = f"file:{quote(self.db_name)}?mode=ro"
+            connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            connection = sqlite3.connect(self.db_name, check_same_thread=False)
+        connection.row_factory = sqlite3.Row  # Allows accessing columns by name
+
+        for name, value in self.pragmas.items():
+            if readonly and name == "journal_mode":
+                continue
+            connection.execute(f"PRAGMA {name} = {value}")
+        if readonly:
+            connection.execute("PRAGMA query_only = ON")
+
+        with self._connections_lock:
+            self._connections.append(connection)
+        return connection
+
+    def _thread_connection(self, readonly):
+        """Return the connection owned by the current thread, opening it on first use."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._open(readonly)
+            self._local.connection = connection
+        return connection
+
+    def _run(self, readonly, func, args):
+        return func(self._thread_connection(readonly), *args)
+
+    async def read(self, func, *args):
+        """Run func(connection, *args) on the reader pool with a read-only connection."""
+        if self._readers is None:
+            return await self.write(func, *args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run, True, func, args)
+
+    async def write(self, func, *args):
+        """Run func(connection, *args) on the single writer thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._run, False, func, args)
+
+    def shutdown(self, wait=True):
+        if self._readers is not None:
+            self._readers.shutdown(wait=wait)
+        self._writer.shutdown(wait=wait)
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
@@ -0,0 +1,162 @@
+from collections import OrderedDict, deque
+
+# ルームごとに保持する最新メッセージの件数
+DEFAULT_MESSAGES_PER_ROOM = 100
+# 全ルーム合計のメモリ使用量の目安(バイト)
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+# メッセージ本文以外(辞書・ID・タイムスタンプ)のおおよそのサイズ
+MESSAGE_OVERHEAD = 256
+# 最後に保存されたmessage_idを覚えておくルーム数。超えたら最も長く保存のないルームから忘れる
+DEFAULT_MAX_TRACKED_ROOMS = 10000
+
+
+def estimate_size(message):
+    return MESSAGE_OVERHEAD + len(message["message"])
+
+
+class RoomHistory:
+    __slots__ = ("messages", "has_older", "size")
+
+    def __init__(self, maxlen):
+        self.messages = deque(maxlen=maxlen)
+        self.has_older = False  # バッファより古いメッセージがDBに存在するか
+        self.size = 0
+
+
+class RecentMessageCache:
+    """
+    Per-room ring buffers holding the most recent messages.
+    ルームに入ったクライアントが取得する最新ページを、DBに問い合わせずに返す。
+    合計サイズが上限を超えると、最も長く読まれていないルームから破棄する。
+    """
+
+    def __init__(
+        self,
+        messages_per_room=DEFAULT_MESSAGES_PER_ROOM,
+        max_bytes=DEFAULT_MAX_BYTES,
+        max_tracked_rooms=DEFAULT_MAX_TRACKED_ROOMS,
+    ):
+        self.messages_per_room = messages_per_room
+        self.max_bytes = max_bytes
+        self.max_tracked_rooms = max_tracked_rooms
+        self._rooms = OrderedDict()  # room_id -> RoomHistory (読まれた順)
+        # room_id -> 最後に保存されたmessage_id (保存された順)。古い seed の登録を防ぐためだけに使うので、
+        # 長く保存のないルームは忘れてよい(その間に読み込み中だった seed はすでに終わっている)
+        self._last_appended = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def latest(self, room_id, limit):
+        """
+        Return the newest page for a room, or None if the buffer cannot answer it.
+        返り値はDBのページング取得と同じ形式
+        """
+        history = self._rooms.get(room_id)
+        if history is None or (
+            limit > len(history.messages) and history.has_older
+        ):
+            self.misses += 1
+            return None
+
+        self._rooms.move_to_end(room_id)
+        self.hits += 1
+        messages = list(history.messages)[-limit:] if limit else []
+        has_more = len(history.messages) > limit or history.has_older
+        return {
+            "status": "success",
+            "messages": messages,
+            "has_more": has_more,
+            "next_before_id": messages[0]["message_id"] if messages else None,
+            "next_after_id": messages[-1]["message_id"] if messages else None,
+        }
+
+    def seed(self, room_id, messages, has_older):
+        """
+        Fill a room's buffer from a newest-first DB page (given oldest-first).
+        DBを読んだ後に保存されたメッセージが含まれていない場合は、古い内容なので登録しない
+        return: 登録した場合は True
+        """
+        newest = messages[-1]["message_id"] if messages else 0
+        if self._last_appended.get(room_id, 0) > newest:
+            return False
+
+        self._drop(room_id)
+        history = RoomHistory(self.messages_per_room)
+        kept = messages[-self.messages_per_room :]
+        history.messages.extend(kept)
+        history.has_older = has_older or len(kept) < len(messages)
+        history.size = sum(estimate_size(message) for message in kept)
+        self._rooms[room_id] = history
+        self.total_bytes += history.size
+        self._evict(keep=room_id)
+        return True
+
+    def append(self, room_id, message):
+        """Record a newly saved message. Rooms that are not buffered are left cold."""
+        message_id = message["message_id"]
+        self._note_saved(room_id, message_id)
+        history = self._rooms.get(room_id)
+        if history is None:
+            return
+        # 保存のコミット後・append の前に seed がDBを読んだ場合、そのメッセージはすでにバッファにある
+        if history.messages and history.messages[-1]["message_id"] >= message_id:
+            return
+
+        if len(history.messages) == history.messages.maxlen:
+            evicted = history.messages[0]
+            history.size -= estimate_size(evicted)
+            self.total_bytes -= estimate_size(evicted)
+            history.has_older = True
+        history.messages.append(message)
+        size = estimate_size(message)
+        history.size += size
+        self.total_bytes += size
+        self._evict(keep=room_id)
+
+    def invalidate(self, room_id, message_id):
+        """
+        Forget a room's buffer because a message was saved elsewhere (another process).
+        message_id より古いページでの再登録も防ぐ
+        """
+        self._note_saved(room_id, message_id)
+        self._drop(room_id)
+
+    def _note_saved(self, room_id, message_id):
+        if self._last_appended.get(room_id, 0) < message_id:
+            self._last_appended[room_id] = message_id
+        self._last_appended.move_to_end(room_id)
+        while len(self._last_appended) > self.max_tracked_rooms:
+            self._last_appended.popitem(last=False)
+
+    def clear(self):
+        """Forget every room's buffer (updates from other processes may have been missed)."""
+        self._rooms.clear()
+        self.total_bytes = 0
+
+    def _drop(self, room_id):
+        history = self._rooms.pop(room_id, None)
+        if history is not None:
+            self.total_bytes -= history.size
+
+    def _evict(self, keep):
+        while self.total_bytes > self.max_bytes and len(self._rooms) > 1:
+            room_id = next(iter(self._rooms))
+            if room_id == keep:
+                self._rooms.move_to_end(room_id)
+                room_id = next(iter(self._rooms))
+            self._drop(room_id)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "rooms": len(self._rooms),
+            "messages": sum(len(history.messages) for history in self._rooms.values()),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "tracked_rooms": len(self._last_appended),
+        }
@@ -0,0 +1,140 @@
+"""
+Logging setup shared by the server modules.
+
+ログの出力(端末への書き込み)は QueueListener のスレッドで行い、イベントループやDBのスレッドは
+レコードをキューに積むだけにする。メッセージは "%s" 形式で渡し、レベルが無効なら整形しない。
+    logger.debug("Received request: %s", request)
+高頻度のイベントは extra=log_extra(sample="key") を付けると、キーごとに sample_every 件に1件だけ出力する。
+log_extra() に渡したその他の値は、JSON形式の出力でフィールドとして出力する。
+環境変数 CHAT_LOG_LEVEL / CHAT_LOG_FORMAT=json / CHAT_LOG_SAMPLE_EVERY で既定値を変更できる
+(spawn で起動するワーカーにも引き継がれる)。
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+import colorlog
+
+LOG_DATE_FORMAT = "%H:%M:%S"
+LOG_FORMAT = "%(log_color)s[%(asctime)s:%(levelname)s-%(name)s] %(message)s"
+LOG_LEVEL = os.environ.get("CHAT_LOG_LEVEL", "INFO").upper()
+LOG_JSON = os.environ.get("CHAT_LOG_FORMAT", "").lower() == "json"
+# sample を付けたイベントを何件に1件出力するか
+DEFAULT_SAMPLE_EVERY = int(os.environ.get("CHAT_LOG_SAMPLE_EVERY", "100"))
+
+_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+_sampler = None
+_loggers = set()
+_level = LOG_LEVEL
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the fields passed through log_extra()."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        sampled = getattr(record, "sampled", None)
+        if sampled is not None:
+            entry["sampled"] = sampled
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Pass one of every `every` records that carry a sample key.
+    sample のないレコードはすべて通す。カウンタはキーごとに持つ。
+    """
+
+    def __init__(self, every=DEFAULT_SAMPLE_EVERY):
+        super().__init__()
+        self.every = every
+        self._seen = {}
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None or self.every <= 1:
+            return True
+        seen = self._seen.get(key, 0)
+        self._seen[key] = seen + 1
+        if seen % self.every:
+            return False
+        # 出力したレコードが何件を代表しているかを残す
+        record.sampled = self.every
+        return True
+
+
+def log_extra(sample=None, **fields):
+    """
+    Build the extra= argument for a log call.
+    param sample: 間引きのキー。同じキーのイベントは sample_every 件に1件だけ出力する
+    param fields: JSON形式の出力に含める値
+    """
+    extra = {"fields": fields}
+    if sample is not None:
+        extra["sample"] = sample
+    return extra
+
+
+def _make_handler(json_format):
+    handler = colorlog.StreamHandler()
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            colorlog.ColoredFormatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+        )
+    return handler
+
+
+def configure_logging(level=None, json_format=None, sample_every=None):
+    """
+    Start (or reconfigure) the background log writer.
+    省略した設定は環境変数の値、または前回の設定を使う。
+    """
+    global _queue_handler, _listener, _sampler, _level
+    with _lock:
+        if _listener is None:
+            log_queue = queue.SimpleQueue()
+            _queue_handler = QueueHandler(log_queue)
+            _sampler = SamplingFilter()
+            _listener = QueueListener(log_queue, _make_handler(LOG_JSON))
+            _listener.start()
+            # 終了時にキューに残ったレコードを書き出す
+            atexit.register(_listener.stop)
+        if json_format is not None:
+            _listener.handlers = (_make_handler(json_format),)
+        if sample_every is not None:
+            _sampler.every = sample_every
+        if level is not None:
+            _level = level.upper() if isinstance(level, str) else level
+            for logger in _loggers:
+                logger.setLevel(_level)
+
+
+def setup_logger(name):
+    """Return the named logger, attached to the shared queue handler exactly once."""
+    configure_logging()
+    logger = logging.getLogger(name)
+    with _lock:
+        if logger not in _loggers:
+            logger.addHandler(_queue_handler)
+            logger.addFilter(_sampler)
+            logger.setLevel(_level)
+            logger.propagate = False
+            _loggers.add(logger)
+    return logger
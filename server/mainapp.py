@@ -1,9 +1,178 @@
+import argparse
 import asyncio
+import multiprocessing
+import os
+import signal
+import tempfile
+from broadcast import BrokerBackend
+from bus import FanoutHub
+from database import AsyncDatabase
+from logs import configure_logging, setup_logger
 from server import ChatServer
 
-if __name__ == "__main__":
-    server = ChatServer()
+
+def parse_address(value):
+    """Parse "host:port" into a (host, port) tuple."""
+    host, _, port = value.rpartition(":")
+    if not host:
+        raise argparse.ArgumentTypeError(f"expected HOST:PORT, got {value!r}")
+    return host, int(port)
+
+
+def create_server(host, port, db_name, broker=None, **kwargs):
+    """
+    Build a ChatServer, connected to the pub/sub broker if one is given.
+    param broker: ブローカーの (host, port)。他のノードとルームを共有する
+    """
+    if broker is not None:
+        kwargs["broadcast_backend"] = BrokerBackend(*broker)
+        # ロードバランサーがどのノードに振り分けても同じセッションIDを使える
+        kwargs["persist_sessions"] = True
+    return ChatServer(host=host, port=port, db_name=db_name, **kwargs)
+
+
+def run_worker(host, port, db_name, bus_path, broker=None, metrics_port=None):
+    """Entry point of a worker process in multi-process mode."""
+    # 親プロセスからの terminate() でも通常の終了処理(未コミットの書き込みの反映)を行う。
+    # Ctrl+C ではプロセスグループ全体と親からの両方でシグナルが届くため、2回目以降は無視する
+    def interrupt_once(signum, frame):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGINT, interrupt_once)
+    signal.signal(signal.SIGTERM, interrupt_once)
+    server = create_server(
+        host,
+        port,
+        db_name,
+        broker,
+        reuse_port=True,
+        # ブローカーを使う場合は、各ワーカーがブローカーに直接接続する
+        bus_path=bus_path if broker is None else None,
+        # セッションはDB経由で共有し、どのワーカーに接続しても同じセッションIDを使える
+        persist_sessions=True,
+        metrics_port=metrics_port,
+    )
     try:
         asyncio.run(server.start())
+    except KeyboardInterrupt:
+        pass
+
+
+async def run_workers(args):
+    """
+    Run args.workers ChatServer processes sharing one port via SO_REUSEPORT.
+    新しいメッセージはこのプロセスの FanoutHub を通じて他のワーカーに配信する。
+    """
+    logger = setup_logger(__name__)
+
+    # スキーマの作成はワーカーを起動する前に1回だけ行う
+    db = AsyncDatabase(args.db)
+    setup_result = await db.setup_database()
+    db.close()
+    if setup_result["status"] == "error":
+        logger.error("Database setup failed: %s", setup_result["message"])
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        bus_path = os.path.join(directory, "bus.sock")
+        hub = FanoutHub(bus_path, logger)
+        await hub.start()
+
+        # ワーカーはDBのスレッドやプロセスプールを持つため、spawn で起動する
+        context = multiprocessing.get_context("spawn")
+        workers = [
+            context.Process(
+                target=run_worker,
+                args=(
+                    args.host,
+                    args.port,
+                    args.db,
+                    bus_path,
+                    args.broker,
+                    # ワーカーごとに別のポートでメトリクスを公開する
+                    None if args.metrics_port is None else args.metrics_port + index,
+                ),
+                name=f"chat-worker-{index}",
+            )
+            for index in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        logger.info(
+            "Started %s workers on %s:%s", args.workers, args.host, args.port
+        )
+
+        # SIGTERM でもワーカーを終了させてから抜ける
+        stopping = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+        try:
+            while not stopping.is_set():
+                if not all(worker.is_alive() for worker in workers):
+                    logger.error("A worker process exited; shutting down.")
+                    break
+                try:
+                    await asyncio.wait_for(stopping.wait(), 0.5)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            for worker in workers:
+                worker.join()
+            await hub.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the chat server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6001)
+    parser.add_argument("--db", default="chat.db")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes sharing the port (SO_REUSEPORT)",
+    )
+    parser.add_argument(
+        "--broker",
+        type=parse_address,
+        default=None,
+        metavar="HOST:PORT",
+        help="pub/sub broker (broker.py) shared with other chat nodes",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="serve plain-text metrics over HTTP (workers use consecutive ports)",
+    )
+    parser.add_argument("--log-level", default=None, help="DEBUG, INFO, WARNING, ...")
+    parser.add_argument(
+        "--log-json", action="store_true", help="write one JSON object per log line"
+    )
+    args = parser.parse_args()
+
+    # spawn で起動するワーカーは環境変数から同じ設定を読み込む
+    if args.log_level is not None:
+        os.environ["CHAT_LOG_LEVEL"] = args.log_level
+    if args.log_json:
+        os.environ["CHAT_LOG_FORMAT"] = "json"
+    configure_logging(level=args.log_level, json_format=args.log_json or None)
+
+    try:
+        if args.workers > 1:
+            asyncio.run(run_workers(args))
+        else:
+            server = create_server(
+                args.host,
+                args.port,
+                args.db,
+                args.broker,
+                metrics_port=args.metrics_port,
+            )
+            asyncio.run(server.start())
     except KeyboardInterrupt:
         print("Server shutting down.")
@@ -0,0 +1,272 @@
+import asyncio
+import functools
+import inspect
+import time
+
+# ヒストグラムの各桁(2のべき乗の区間)を分割する数。相対誤差は 1/64 (約1.6%) 以内
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+# stats アクションとスクレイプで報告するパーセンタイル
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+# HTTPリクエストの読み込みを待つ最大秒数
+HTTP_READ_TIMEOUT = 5.0
+
+
+class Histogram:
+    """
+    HDR-style histogram of non-negative integers with bounded relative error.
+    値が小さい範囲は1刻み、それ以上は2のべき乗ごとに同じ数のバケットに分けるため、
+    マイクロ秒から数分までのレイテンシを数百個のカウンタで記録できる。
+    param scale: 報告時に値に掛ける係数(マイクロ秒で記録して秒で報告する場合は 1e-6)
+    """
+
+    def __init__(self, scale=1):
+        self.scale = scale
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(value):
+        if value < 2 * SUB_BUCKET_HALF:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return shift * SUB_BUCKET_HALF + (value >> shift)
+
+    @staticmethod
+    def _bounds(index):
+        """Return the lowest value and width of a bucket."""
+        if index < 2 * SUB_BUCKET_HALF:
+            return index, 1
+        shift = index // SUB_BUCKET_HALF - 1
+        return (index - shift * SUB_BUCKET_HALF) << shift, 1 << shift
+
+    def record(self, value):
+        value = max(0, int(value))
+        index = self._index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """Scaled value at the given fraction (0-1): the bucket midpoint, capped at max."""
+        if self.count == 0:
+            return 0
+        rank = max(1, round(self.count * fraction))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                low, width = self._bounds(index)
+                return min(low + width // 2, self.max) * self.scale
+        return self.max * self.scale
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.total * self.scale,
+            "max": self.max * self.scale,
+            **{f"p{q * 100:g}": self.percentile(q) for q in QUANTILES},
+        }
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape_label(value):
+    # テキスト形式ではラベル値の \ " 改行をエスケープする
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs)
+        + "}"
+    )
+
+
+class Metrics:
+    """
+    Counters, histograms and gauges for one ChatServer.
+    記録はイベントループのスレッドからのみ行う前提で、ロックは使わない。
+    ゲージは既存の stats() のような辞書を返す関数として登録し、読み出すときに評価する。
+    """
+
+    def __init__(self, prefix="chat"):
+        self.prefix = prefix
+        self.counters = {}  # name -> {ラベルのタプル: 値}
+        self.histograms = {}  # name -> {ラベルのタプル: Histogram}
+        self._gauges = {}  # name -> 辞書を返す関数
+
+    def inc(self, name, amount=1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, scale=1, **labels):
+        """Record a value into the histogram for name and labels."""
+        series = self.histograms.setdefault(name, {})
+        key = _label_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(scale)
+        histogram.record(value)
+
+    def observe_seconds(self, name, seconds, **labels):
+        """Record a duration with microsecond resolution; reported in seconds."""
+        self.observe(name, seconds * 1e6, scale=1e-6, **labels)
+
+    def add_gauges(self, name, stats):
+        """
+        Expose every numeric value of stats() as a gauge.
+        param stats: 数値を含む辞書を返す関数(SessionStore.stats など)
+        """
+        self._gauges[name] = stats
+
+    def gauges(self):
+        values = {}
+        for name, stats in self._gauges.items():
+            values[name] = {
+                key: value
+                for key, value in stats().items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)
+            }
+        return values
+
+    def snapshot(self):
+        """All metrics as a JSON-serializable dict (used by the stats action)."""
+
+        def labelled(series, convert):
+            return [
+                {"labels": dict(key), **convert(value)} for key, value in series.items()
+            ]
+
+        return {
+            "counters": {
+                name: labelled(series, lambda value: {"value": value})
+                for name, series in self.counters.items()
+            },
+            "histograms": {
+                name: labelled(series, Histogram.snapshot)
+                for name, series in self.histograms.items()
+            },
+            "gauges": self.gauges(),
+        }
+
+    def render_text(self):
+        """Render the metrics in the Prometheus plain-text exposition format."""
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            metric = f"{self.prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for key, value in series.items():
+                lines.append(f"{metric}{_format_labels(key)} {value}")
+        for name, series in sorted(self.histograms.items()):
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} summary")
+            for key, histogram in series.items():
+                for q in QUANTILES:
+                    labels = _format_labels(key, [("quantile", q)])
+                    lines.append(f"{metric}{labels} {histogram.percentile(q):g}")
+                labels = _format_labels(key)
+                total = histogram.total * histogram.scale
+                lines.append(f"{metric}_sum{labels} {total:g}")
+                lines.append(f"{metric}_count{labels} {histogram.count}")
+        for name, values in sorted(self.gauges().items()):
+            for key, value in values.items():
+                metric = f"{self.prefix}_{name}_{key}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def instrument_methods(obj, metrics, name):
+    """
+    Time every public coroutine method of obj into the histogram name{method=...}.
+    インスタンスの属性としてラップするため、クラスや他のインスタンスには影響しない。
+    """
+    for attribute in dir(type(obj)):
+        if attribute.startswith("_"):
+            continue
+        method = getattr(obj, attribute)
+        if not inspect.iscoroutinefunction(method):
+            continue
+
+        def wrap(method, attribute):
+            @functools.wraps(method)
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    metrics.observe_seconds(
+                        name, time.perf_counter() - started, method=attribute
+                    )
+
+            return timed
+
+        setattr(obj, attribute, wrap(method, attribute))
+
+
+class MetricsHttpServer:
+    """
+    Minimal HTTP endpoint that serves Metrics.render_text() for scrapers.
+    GET /metrics 以外は 404 を返す。1リクエストごとに接続を閉じる。
+    """
+
+    def __init__(self, metrics, host, port, logger=None):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.logger = logger
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        if self.logger is not None:
+            self.logger.info(
+                "Metrics endpoint on http://%s:%s/metrics", self.host, self.port
+            )
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), HTTP_READ_TIMEOUT)
+            # ヘッダーは読み飛ばす
+            while True:
+                line = await asyncio.wait_for(reader.readline(), HTTP_READ_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1] in ("/metrics", "/"):
+                status = "200 OK"
+                body = self.metrics.render_text().encode()
+            else:
+                status = "404 Not Found"
+                body = b"not found\n"
+            writer.write(
+                f"HTTP/1.0 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
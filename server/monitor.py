@@ -0,0 +1,79 @@
+import asyncio
+
+# イベントループの遅延を計測する間隔(秒)
+DEFAULT_LAG_INTERVAL = 0.1
+# この値(ミリ秒)を超えてループが止まった場合に警告する
+DEFAULT_LAG_THRESHOLD_MS = 50
+
+
+class LoopLagMonitor:
+    """
+    Measure how late the event loop wakes up from a fixed-interval sleep.
+    遅延が大きいほど、どこかの処理がイベントループのスレッドをブロックしていることを示す。
+    """
+
+    def __init__(
+        self,
+        interval=DEFAULT_LAG_INTERVAL,
+        threshold_ms=DEFAULT_LAG_THRESHOLD_MS,
+        logger=None,
+        metrics=None,
+    ):
+        """
+        param metrics: 指定すると遅延を event_loop_lag_seconds のヒストグラムにも記録する
+        """
+        self.interval = interval
+        self.threshold_ms = threshold_ms
+        self.logger = logger
+        self.metrics = metrics
+        self.samples = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.over_threshold = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (loop.time() - started - self.interval) * 1000)
+            self.record(lag_ms)
+
+    def record(self, lag_ms):
+        self.samples += 1
+        self.last_lag_ms = lag_ms
+        if self.metrics is not None:
+            self.metrics.observe_seconds("event_loop_lag_seconds", lag_ms / 1000)
+        if lag_ms > self.max_lag_ms:
+            self.max_lag_ms = lag_ms
+        if lag_ms > self.threshold_ms:
+            self.over_threshold += 1
+            if self.logger is not None:
+                self.logger.warning(
+                    "Event loop blocked for %.1f ms (threshold %s ms)",
+                    lag_ms,
+                    self.threshold_ms,
+                )
+
+    def stats(self):
+        return {
+            "samples": self.samples,
+            "last_lag_ms": round(self.last_lag_ms, 3),
+            "max_lag_ms": round(self.max_lag_ms, 3),
+            "threshold_ms": self.threshold_ms,
+            "over_threshold": self.over_threshold,
+        }
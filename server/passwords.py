@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import hmac
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# 保存形式: "<scheme>$<パラメータ...>$<salt(hex)>$<hash(hex)>"
+# "$" を含まない64文字の16進数は、以前の形式(ソルトなしのSHA-256)として扱う
+SCHEME_SCRYPT = "scrypt"
+SCHEME_PBKDF2 = "pbkdf2_sha256"
+DEFAULT_SCHEME = SCHEME_SCRYPT
+
+# scrypt: N=2^14, r=8 で1回あたり約16MiBのメモリを使う
+SCRYPT_N = 2**14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600000
+SALT_SIZE = 16
+HASH_SIZE = 32
+
+# ハッシュ計算を行うプロセス数と、同時に計算を依頼する上限
+DEFAULT_HASH_WORKERS = max(1, min(4, os.cpu_count() or 1))
+DEFAULT_MAX_CONCURRENT_HASHES = DEFAULT_HASH_WORKERS * 2
+
+
+def hash_password(password, scheme=DEFAULT_SCHEME):
+    """Hash a password with a random salt in the versioned storage format."""
+    salt = os.urandom(SALT_SIZE)
+    if scheme == SCHEME_SCRYPT:
+        digest = hashlib.scrypt(
+            password.encode(),
+            salt=salt,
+            n=SCRYPT_N,
+            r=SCRYPT_R,
+            p=SCRYPT_P,
+            dklen=HASH_SIZE,
+        )
+        params = f"{SCRYPT_N}${SCRYPT_R}${SCRYPT_P}"
+    elif scheme == SCHEME_PBKDF2:
+        digest = hashlib.pbkdf2_hmac(
+            "sha256", password.encode(), salt, PBKDF2_ITERATIONS, HASH_SIZE
+        )
+        params = str(PBKDF2_ITERATIONS)
+    else:
+        raise ValueError(f"Unknown password scheme: {scheme}")
+    return f"{scheme}${params}${salt.hex()}${digest.hex()}"
+
+
+def dummy_hash(scheme=DEFAULT_SCHEME):
+    """
+    A well-formed hash that no password matches.
+    存在しないユーザーのログインでも同じ計算コストをかけ、応答時間からユーザー名を推測されないようにする
+    """
+    if scheme == SCHEME_SCRYPT:
+        params = f"{SCRYPT_N}${SCRYPT_R}${SCRYPT_P}"
+    elif scheme == SCHEME_PBKDF2:
+        params = str(PBKDF2_ITERATIONS)
+    else:
+        raise ValueError(f"Unknown password scheme: {scheme}")
+    return f"{scheme}${params}${'00' * SALT_SIZE}${'00' * HASH_SIZE}"
+
+
+def verify_password(password, stored, scheme=DEFAULT_SCHEME):
+    """
+    Check a password against a stored hash of any supported format.
+    return: (一致したか, 現在の形式で保存し直すべきか)
+    """
+    parts = stored.split("$")
+    if len(parts) == 1:
+        # 以前の形式。一致した場合は新しい形式に置き換える
+        digest = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(digest, stored), True
+
+    try:
+        return _verify_versioned(password, parts, scheme)
+    except ValueError:
+        return False, False  # 壊れた保存値
+
+
+def _verify_versioned(password, parts, scheme):
+    name = parts[0]
+    if name == SCHEME_SCRYPT and len(parts) == 6:
+        n, r, p = (int(value) for value in parts[1:4])
+        salt, expected = bytes.fromhex(parts[4]), bytes.fromhex(parts[5])
+        digest = hashlib.scrypt(
+            password.encode(),
+            salt=salt,
+            n=n,
+            r=r,
+            p=p,
+            dklen=len(expected),
+            maxmem=2 * 128 * n * r * p,
+        )
+        outdated = (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    elif name == SCHEME_PBKDF2 and len(parts) == 4:
+        iterations = int(parts[1])
+        salt, expected = bytes.fromhex(parts[2]), bytes.fromhex(parts[3])
+        digest = hashlib.pbkdf2_hmac(
+            "sha256", password.encode(), salt, iterations, len(expected)
+        )
+        outdated = iterations != PBKDF2_ITERATIONS
+    else:
+        return False, False
+
+    matched = hmac.compare_digest(digest, expected)
+    return matched, matched and (outdated or name != scheme)
+
+
+class PasswordHasher:
+    """
+    Run password hashing in a dedicated process pool.
+    KDFは意図的に重いため、イベントループやDBスレッドでは計算しない。
+    同時に依頼する数をセマフォで制限し、ログインが集中しても待ち行列はイベントループ側に留める。
+    """
+
+    def __init__(
+        self,
+        workers=DEFAULT_HASH_WORKERS,
+        max_concurrent=DEFAULT_MAX_CONCURRENT_HASHES,
+        scheme=DEFAULT_SCHEME,
+    ):
+        self.workers = workers
+        self.max_concurrent = max_concurrent
+        self.scheme = scheme
+        self._pool = None
+        self._semaphore = None
+        self.hashed = 0
+        self.verified = 0
+        self.upgraded = 0
+
+    def _executor(self):
+        if self._pool is None:
+            # DBのスレッドを持つプロセスを fork しないよう、spawn で起動する
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._pool
+
+    async def _run(self, func, *args):
+        pool = self._executor()
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(pool, func, *args)
+
+    async def hash(self, password):
+        """Return the stored form of a new password."""
+        self.hashed += 1
+        return await self._run(hash_password, password, self.scheme)
+
+    async def verify(self, password, stored):
+        """
+        Check a password against its stored hash.
+        return: (一致したか, 保存し直すべきか)
+        """
+        self.verified += 1
+        return await self._run(verify_password, password, stored, self.scheme)
+
+    async def verify_dummy(self, password):
+        """Spend the same time as verify() for a user that does not exist. Never matches."""
+        self.verified += 1
+        await self._run(verify_password, password, dummy_hash(self.scheme), self.scheme)
+        return False
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+    def stats(self):
+        return {
+            "scheme": self.scheme,
+            "workers": self.workers,
+            "max_concurrent": self.max_concurrent,
+            "hashed": self.hashed,
+            "verified": self.verified,
+            "upgraded": self.upgraded,
+        }
@@ -0,0 +1,68 @@
+import struct
+
+from codec import JSON
+
+# フレーム形式: 4バイト(ビッグエンディアン)のペイロード長 + ペイロード
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+class FrameError(ValueError):
+    """Raised when the peer sends a frame that violates the protocol."""
+
+
+def encode_frame(payload):
+    """Prefix the payload with its length."""
+    return HEADER.pack(len(payload)) + payload
+
+
+def encode_message(message, codec=JSON):
+    """
+    Serialize a message with the given codec and frame it.
+    返り値は不変の bytes なので、ブロードキャストでは同じコーデックの受信者全員で同じオブジェクトを共有できる。
+    """
+    return encode_frame(codec.encode(message))
+
+
+class FrameDecoder:
+    """
+    Incremental decoder for length-prefixed frames.
+    受信バッファは接続ごとに再利用し、1回の読み込みで届いた複数フレームをまとめて取り出す。
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data):
+        """
+        Append received bytes and return every complete frame payload.
+        param data: ソケットから読み込んだバイト列
+        return: 完成したフレームのペイロード(bytes)のリスト
+        """
+        buffer = self._buffer
+        buffer += data
+
+        frames = []
+        offset = 0
+        end = len(buffer)
+        with memoryview(buffer) as view:
+            while end - offset >= HEADER.size:
+                (length,) = HEADER.unpack_from(buffer, offset)
+                if length > self.max_frame_size:
+                    raise FrameError(
+                        f"Frame of {length} bytes exceeds limit of {self.max_frame_size}"
+                    )
+                start = offset + HEADER.size
+                if end - start < length:
+                    break
+                frames.append(view[start : start + length].tobytes())
+                offset = start + length
+
+        # 処理済みの部分はフレームごとではなく、読み込み1回につき1度だけ詰める
+        if offset:
+            del buffer[:offset]
+        return frames
@@ -0,0 +1,144 @@
+import time
+
+INVALID_SESSION = {"status": "error", "message": "Invalid or expired session"}
+UNKNOWN_ACTION = {"status": "error", "message": "Unknown action"}
+# DBのIDやページングの値を表すフィールド。ハンドラに渡す前に int に変換する
+# ("1" と 1 が別のルームとして購読やキャッシュのキーにならないようにする)
+INTEGER_FIELDS = ("room_id", "user_id", "before_id", "after_id", "limit")
+# SQLite の INTEGER (符号付き64ビット) に収まる範囲
+MIN_INTEGER = -(2**63)
+MAX_INTEGER = 2**63 - 1
+
+
+def to_int(value):
+    """Convert an integer-valued field (int, integral float or numeric string) to int."""
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"not an integer: {value!r}")
+    value = int(value)
+    if not MIN_INTEGER <= value <= MAX_INTEGER:
+        raise ValueError(f"out of range: {value}")
+    return value
+
+
+def action(name, auth=False, fields=(), limited=False):
+    """
+    Mark a handler method as the implementation of a client action.
+    param auth: True の場合、session_id を検証してから呼び出す
+    param fields: リクエストに必須のフィールド名
+    param limited: True の場合、呼び出す前に check_limit でレート制限を確認する
+        (コミットや配信を伴う、連続で呼ばれると負荷の大きいアクション)
+    """
+
+    def decorator(handler):
+        handler._action_spec = (name, auth, tuple(fields), limited)
+        return handler
+
+    return decorator
+
+
+class ActionSpec:
+    __slots__ = ("name", "handler", "auth", "fields", "limited")
+
+    def __init__(self, name, handler, auth, fields, limited=False):
+        self.name = name
+        self.handler = handler
+        self.auth = auth
+        self.fields = fields
+        self.limited = limited
+
+
+class RequestContext:
+    """Everything a handler needs for one request."""
+
+    __slots__ = ("action", "request", "client", "user_id")
+
+    def __init__(self, action, request, client, user_id=None):
+        self.action = action
+        self.request = request
+        self.client = client
+        self.user_id = user_id  # auth=True のアクションでは検証済みのユーザーID
+
+    def get(self, key, default=None):
+        return self.request.get(key, default)
+
+
+class ActionRegistry:
+    """
+    Dispatch table from action name to handler coroutine.
+    セッション検証と必須フィールドの確認はここで1回だけ行い、ハンドラは処理本体だけを書く。
+    """
+
+    def __init__(self, validate_session, check_limit=None):
+        """
+        param check_limit: check_limit(ctx) -> 拒否する場合のレスポンス、許可する場合は None
+        """
+        self.validate_session = validate_session
+        self.check_limit = check_limit
+        self._actions = {}
+        self._hooks = []
+
+    def __contains__(self, name):
+        return isinstance(name, str) and name in self._actions
+
+    def names(self):
+        return list(self._actions)
+
+    def register(self, name, handler, auth=False, fields=(), limited=False):
+        """Register handler(ctx) -> response for an action, replacing any existing one."""
+        self._actions[name] = ActionSpec(name, handler, auth, tuple(fields), limited)
+
+    def register_handlers(self, owner):
+        """Register every method of owner decorated with @action."""
+        for attribute in dir(type(owner)):
+            spec = getattr(getattr(type(owner), attribute), "_action_spec", None)
+            if spec is not None:
+                name, auth, fields, limited = spec
+                self.register(name, getattr(owner, attribute), auth, fields, limited)
+
+    def add_hook(self, hook):
+        """Call hook(action, elapsed_seconds, response) after every dispatched request."""
+        self._hooks.append(hook)
+
+    async def dispatch(self, action, request, client=None):
+        # リストなどハッシュできない値も、未知のアクションとして扱う
+        spec = self._actions.get(action) if isinstance(action, str) else None
+        if spec is None:
+            return dict(UNKNOWN_ACTION)
+
+        started = time.perf_counter()
+        response = await self._call(spec, request, client)
+        elapsed = time.perf_counter() - started
+        for hook in self._hooks:
+            hook(action, elapsed, response)
+        return response
+
+    async def _call(self, spec, request, client):
+        missing = [field for field in spec.fields if request.get(field) is None]
+        if missing:
+            return {
+                "status": "error",
+                "message": f"Missing required field(s): {', '.join(missing)}",
+            }
+
+        converted = {}
+        for field in INTEGER_FIELDS:
+            if request.get(field) is not None:
+                try:
+                    converted[field] = to_int(request[field])
+                except (TypeError, ValueError, OverflowError):
+                    return {"status": "error", "message": f"{field} must be an integer"}
+        if converted:
+            request = {**request, **converted}
+
+        context = RequestContext(spec.name, request, client)
+        if spec.auth:
+            context.user_id = await self.validate_session(request.get("session_id"))
+            if not context.user_id:
+                return dict(INVALID_SESSION)
+
+        if spec.limited and self.check_limit is not None:
+            rejection = self.check_limit(context)
+            if rejection is not None:
+                return rejection
+
+        return await spec.handler(context)
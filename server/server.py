@@ -1,302 +1,672 @@
 import asyncio
-import json
 import time
 from database import AsyncDatabase
-from logging import getLogger, DEBUG, INFO
-import colorlog
-from utils import generate_session_id
-import socket
-
-# colorlog用の設定
-LOG_DATE_FORMAT = "%H:%M:%S"
-LOG_FORMAT = "%(log_color)s[%(asctime)s:%(levelname)s-%(name)s] %(message)s"
-LOG_LEVEL = INFO
-
-def setup_logger():
-    handler = colorlog.StreamHandler()
-    formatter = colorlog.ColoredFormatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
-    handler.setFormatter(formatter)
-
-    logger = getLogger(__name__)
-    logger.addHandler(handler)
-    logger.setLevel(LOG_LEVEL)
-    return logger
+from db_executor import DEFAULT_READER_THREADS
+from logs import log_extra, setup_logger
+from protocol import FrameDecoder, FrameError, encode_message
+from codec import CODECS, CodecError, negotiate
+from compression import COMPRESSIONS, DEFAULT_COMPRESSION_THRESHOLD, FrameCompressor
+from connection import (
+    ClientConnection,
+    DEFAULT_SEND_QUEUE_SIZE,
+    DEFAULT_WRITE_BUFFER_HIGH,
+    DEFAULT_WRITE_BUFFER_LOW,
+    POLICY_DROP_OLDEST,
+)
+from monitor import LoopLagMonitor, DEFAULT_LAG_THRESHOLD_MS
+from metrics import Metrics, MetricsHttpServer, instrument_methods
+from admission import (
+    AdmissionController,
+    TOO_MANY_CONNECTIONS,
+    DEFAULT_IP_BURST,
+    DEFAULT_IP_RATE,
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_MAX_CONNECTIONS_PER_IP,
+    DEFAULT_MAX_INFLIGHT_TOTAL,
+    DEFAULT_SESSION_BURST,
+    DEFAULT_SESSION_RATE,
+)
+from registry import ActionRegistry, action
+from sessions import SessionStore, DEFAULT_MAX_SESSIONS, DEFAULT_SESSION_TTL
+from broadcast import FanoutBusBackend, InProcessBackend
+
+# 1回のreadで読み込む最大バイト数
+RECV_BUFFER_SIZE = 65536
+# listen()の待ち行列の長さ。接続が集中しても拒否せずに受け付ける
+DEFAULT_BACKLOG = 1024
+# request_id 付きリクエストを1接続あたり同時に処理する上限
+DEFAULT_MAX_INFLIGHT = 32
+# batch アクション1回に含められるサブリクエストの上限
+MAX_BATCH_REQUESTS = 64
+# batch に含められないアクション(入れ子の batch と、接続の形式を切り替える hello)
+NOT_BATCHABLE_ACTIONS = ("batch", "hello")
 
 
 class ChatServer:
-    def __init__(self, host="127.0.0.1", port=6001):
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=6001,
+        db_name="chat.db",
+        backlog=DEFAULT_BACKLOG,
+        write_buffer_high=DEFAULT_WRITE_BUFFER_HIGH,
+        write_buffer_low=DEFAULT_WRITE_BUFFER_LOW,
+        send_queue_size=DEFAULT_SEND_QUEUE_SIZE,
+        slow_consumer_policy=POLICY_DROP_OLDEST,
+        loop_lag_threshold_ms=DEFAULT_LAG_THRESHOLD_MS,
+        db_reader_threads=DEFAULT_READER_THREADS,
+        db_pragmas=None,
+        max_inflight_requests=DEFAULT_MAX_INFLIGHT,
+        compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+        session_ttl=DEFAULT_SESSION_TTL,
+        max_sessions=DEFAULT_MAX_SESSIONS,
+        persist_sessions=False,
+        reuse_port=False,
+        bus_path=None,
+        broadcast_backend=None,
+        metrics_port=None,
+        rate_limit=DEFAULT_SESSION_RATE,
+        rate_limit_burst=DEFAULT_SESSION_BURST,
+        ip_rate_limit=DEFAULT_IP_RATE,
+        ip_rate_limit_burst=DEFAULT_IP_BURST,
+        max_inflight_total=DEFAULT_MAX_INFLIGHT_TOTAL,
+        max_connections=DEFAULT_MAX_CONNECTIONS,
+        max_connections_per_ip=DEFAULT_MAX_CONNECTIONS_PER_IP,
+    ):
+        """
+        param reuse_port: SO_REUSEPORT を設定し、複数のプロセスで同じポートを受け付ける
+        param bus_path: ワーカー間の配信に使う FanoutHub のUnixソケットのパス
+        param broadcast_backend: 配信に使う BroadcastBackend(broadcast.py)。
+            省略時は bus_path があれば FanoutBusBackend、なければ InProcessBackend
+        param metrics_port: 指定するとこのポートでメトリクスをテキスト形式で公開する(GET /metrics)
+        param rate_limit: limited なアクション(add_message など)のセッションごとの回数/秒(None で無効)
+        param ip_rate_limit: IPアドレスごとの全リクエストの回数/秒(None で無効)
+        param max_inflight_total: サーバー全体の同時処理数の上限。超えたリクエストには busy を返す
+        param max_connections: 同時接続数の上限。超えた接続には busy を返して切断する
+        """
         self.host = host
         self.port = port
-        self.db = AsyncDatabase("chat.db")
-        self.sessions = {}
-        self.clients = []  # 接続中のクライアントを管理するリスト
-        self.room_clients = {}
-        self.logger = setup_logger()
+        self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.write_buffer_high = write_buffer_high
+        self.write_buffer_low = write_buffer_low
+        self.send_queue_size = send_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.max_inflight_requests = max_inflight_requests
+        self.compression_threshold = compression_threshold
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        # アクションごとの処理時間・DBメソッドごとの所要時間・配信の規模などを記録する
+        self.metrics = Metrics()
+        self.db = AsyncDatabase(
+            db_name, reader_threads=db_reader_threads, pragmas=db_pragmas
+        )
+        instrument_methods(self.db, self.metrics, "db_query_seconds")
+        self.server = None
+        self.clients = set()  # 接続中のクライアントを管理する集合
+        self.room_clients = {}  # room_id -> 購読中のクライアントの集合
+        self.logger = setup_logger(__name__)
+        # 配信はバックエンドを通して行い、他のプロセスやノードの購読者にも届ける
+        if broadcast_backend is None:
+            if bus_path is not None:
+                broadcast_backend = FanoutBusBackend(bus_path)
+            else:
+                broadcast_backend = InProcessBackend()
+        self.broadcaster = broadcast_backend
+        self.broadcaster.bind(self._deliver_local, self._room_updated, self.logger)
+        # 操作のたびに期限を延長し、期限切れはバックグラウンドで定期的に削除する
+        # persist_sessions の場合はDBに保存し、再起動後も同じセッションIDを使える
+        self.sessions = SessionStore(
+            ttl=session_ttl,
+            max_sessions=max_sessions,
+            logger=self.logger,
+            backend=self.db if persist_sessions else None,
+        )
+        # イベントループを一定時間以上ブロックする処理がないかを監視する
+        self.loop_monitor = LoopLagMonitor(
+            threshold_ms=loop_lag_threshold_ms, logger=self.logger, metrics=self.metrics
+        )
+        # action -> ハンドラの対応表。@action を付けたメソッドを登録し、
+        # 拡張は self.actions.register() で追加する
+        # 連続で呼ばれると負荷の大きいアクションの流量と、サーバー全体の同時処理数を制限する
+        self.admission = AdmissionController(
+            session_rate=rate_limit,
+            session_burst=rate_limit_burst,
+            ip_rate=ip_rate_limit,
+            ip_burst=ip_rate_limit_burst,
+            max_inflight_total=max_inflight_total,
+            max_connections=max_connections,
+            max_connections_per_ip=max_connections_per_ip,
+        )
+        self.actions = ActionRegistry(
+            self.validate_session, self.admission.check_action
+        )
+        self.actions.register_handlers(self)
+        self.actions.add_hook(self._record_request)
+
+        self.metrics.add_gauges(
+            "clients",
+            lambda: {"connected": len(self.clients), "rooms": len(self.room_clients)},
+        )
+        self.metrics.add_gauges("sessions", self.sessions.stats)
+        self.metrics.add_gauges("event_loop", self.loop_monitor.stats)
+        self.metrics.add_gauges("send_queue", self.send_queue_stats)
+        self.metrics.add_gauges("broadcast", self.broadcaster.stats)
+        self.metrics.add_gauges("admission", self.admission.stats)
+        self.metrics.add_gauges("username_cache", self.db.username_cache.stats)
+        self.metrics.add_gauges("recent_messages", self.db.recent_messages.stats)
 
     # セッションを作成
     def create_session(self, user_id):
-        session_id = generate_session_id(user_id)
-        exception_time = time.time() + 3600
-        self.sessions[session_id] = {"user_id": user_id, "exception_at": exception_time}
-        self.logger.debug(f"Session created: {self.sessions}")
+        session_id = self.sessions.create(user_id)
+        self.logger.debug("Session created for user %s", user_id)
         return session_id
 
     # セッションの有効期限を確認
-    def validate_session(self, session_id):
+    async def validate_session(self, session_id):
         """
         Validate the given session ID.
         param session_id: セッションID
         return: セッションが有効ならユーザーIDを返し、無効なら None を返す
         """
-        session = self.sessions.get(session_id)
-        self.logger.debug(f"Validating session: {session_id}")
-        if session:
-            # セッションが有効期限内かをチェック
-            if time.time() < session["exception_at"]:
-                self.logger.debug(f"Session validated: {session}")
-                return session["user_id"]
-            else:
-                # セッションが期限切れなら削除
-                del self.sessions[session_id]
-                self.logger.error(f"Session expired: {session}")
-        return None
+        # 有効なセッションは期限が延長される
+        return await self.sessions.validate(session_id)
 
     def add_client_to_room(self, room_id, client):
         if room_id not in self.room_clients:
-            self.room_clients[room_id] = []
+            self.room_clients[room_id] = set()
+            self.broadcaster.subscribe(room_id)
         if client not in self.room_clients[room_id]:
-            self.room_clients[room_id].append(client)
-            self.logger.debug(f"Added client to room: {room_id}")
+            self.room_clients[room_id].add(client)
+            client.rooms.add(room_id)
+            self.logger.debug("Added client to room: %s", room_id)
 
     def remove_client_from_room(self, room_id, client):
+        client.rooms.discard(room_id)
         if room_id in self.room_clients and client in self.room_clients[room_id]:
-            self.room_clients[room_id].remove(client)
-            self.logger.debug(f"Removed client from room: {room_id}")
+            self.room_clients[room_id].discard(client)
+            self.logger.debug("Removed client from room: %s", room_id)
 
             # ルームが空になったら削除
             if not self.room_clients[room_id]:
                 del self.room_clients[room_id]
+                self.broadcaster.unsubscribe(room_id)
+
+    def remove_client(self, client):
+        """Drop a disconnected client from the client list and every room it subscribed to."""
+        self.clients.discard(client)
+        for room_id in list(client.rooms):
+            self.remove_client_from_room(room_id, client)
 
     async def start(self):
         """Start the server."""
         setup_result = await self.db.setup_database()
         if setup_result["status"] == "error":
-            self.logger.info(f"Database setup failed: {setup_result['message']}")
+            self.logger.info("Database setup failed: %s", setup_result["message"])
             return
         self.logger.info("Database setup completed successfully.")
 
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server.setblocking(False)
-        server.bind((self.host, self.port))
-        server.listen(5)
-
-        loop = asyncio.get_event_loop()
-        self.logger.info(f"Chat server started on {self.host}:{self.port}")
-        while True:
-            client, address = await loop.sock_accept(server)
-            self.logger.info(f"Accepted new client connection: {address}")
-            client.setblocking(False)
-            self.clients.append(client)  # 新しいクライアントをリストに追加
-            asyncio.create_task(self.handle_client(client, loop))
-
-    async def handle_client(self, client, loop):
+        await self.broadcaster.start()
+
+        self.server = await asyncio.start_server(
+            self.handle_client,
+            self.host,
+            self.port,
+            backlog=self.backlog,
+            reuse_port=self.reuse_port or None,
+        )
+        self.logger.info("Chat server started on %s:%s", self.host, self.port)
+        if self.metrics_port is not None:
+            self.metrics_server = MetricsHttpServer(
+                self.metrics, self.host, self.metrics_port, self.logger
+            )
+            await self.metrics_server.start()
+        self.loop_monitor.start()
+        self.sessions.start()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            if self.metrics_server is not None:
+                await self.metrics_server.stop()
+            await self.loop_monitor.stop()
+            await self.sessions.stop()
+            await self.broadcaster.close()
+            await self.db.flush()
+            self.db.close()
+
+    async def handle_client(self, reader, writer):
         """Handle client requests."""
+        client = ClientConnection(
+            reader,
+            writer,
+            self.write_buffer_high,
+            self.write_buffer_low,
+            self.send_queue_size,
+            self.slow_consumer_policy,
+        )
+        client.start()
+        if not self.admission.open_connection(client):
+            self.logger.warning("Refused connection (limit reached): %s", client.address)
+            await self.send_response(client, dict(TOO_MANY_CONNECTIONS))
+            await client.aclose()
+            return
+        self.logger.info(
+            "Accepted new client connection: %s",
+            client.address,
+            extra=log_extra(sample="client_connected"),
+        )
+        self.clients.add(client)  # 新しいクライアントを追加
+        decoder = FrameDecoder()
+        # request_id 付きのリクエストは並行に処理し、上限に達したら読み込みを止める
+        inflight = set()
+        slots = asyncio.Semaphore(self.max_inflight_requests)
         try:
             # クライアントからの接続を永続的に待機
             while True:
-                data = await loop.sock_recv(client, 1024)
+                data = await reader.read(RECV_BUFFER_SIZE)
                 if not data:
                     break  # クライアントが切断した場合に終了
-                request = json.loads(data.decode())
-                self.logger.debug(f"Received request: {request}")
-
-                action = request.get("action")
-                response = await self.route_request(action, request)
-
-                # クライアントへのレスポンス送信
-                try:
-                    await loop.sock_sendall(client, json.dumps(response).encode())
-                except (BrokenPipeError, ConnectionResetError) as e:
-                    self.logger.error(f"Error sending data to client: {e}")
-                    client.close()
-
-                # メッセージが送信された場合、そのメッセージを全クライアントに送信
-                if action == "add_message":
-                    room_id = request.get("room_id")
-                    session_id = request.get("session_id")
-                    user_id = self.validate_session(session_id)
-                    user_name_result = await self.db.get_username_by_user_id(user_id)
-
-                    user_name = user_name_result.get("username")
-                    self.logger.info(f"User name: {user_name}")
-                    message_data = json.dumps(
-                        {
-                            "action": "new_message",
-                            "message": request.get("message"),
-                            "room_id": request.get("room_id"),
-                            "user_name": user_name,
-                        }
-                    )
-
-                    await self.broadcast_message(message_data, loop)
-                    self.logger.debug(f"Broadcasted message to room: {room_id}")
-                    self.logger.debug(f"Broadcasted message: {message_data}")
 
+                # 1回の受信に含まれるすべてのフレームを順に処理
+                for frame in decoder.feed(data):
+                    try:
+                        request = client.codec.decode(frame)
+                        if not isinstance(request, dict):
+                            raise CodecError("request must be an object")
+                    except CodecError as e:
+                        self.logger.error("Invalid request frame: %s", e)
+                        message = f"Invalid {client.codec.label}"
+                        await self.send_response(
+                            client, {"status": "error", "message": message}
+                        )
+                        continue
+
+                    # hello は以降のフレームの形式を変えるため、必ず順番どおりに処理する
+                    if (
+                        request.get("request_id") is None
+                        or request.get("action") == "hello"
+                    ):
+                        await self.process_request(client, request)
+                    else:
+                        await slots.acquire()
+                        task = asyncio.create_task(
+                            self.process_concurrent(client, request, slots)
+                        )
+                        inflight.add(task)
+                        task.add_done_callback(inflight.discard)
+
+        except FrameError as e:
+            self.logger.error("Protocol error from client: %s", e)
         except Exception as e:
-            self.logger.error(f"Error handling client: {e}")
+            self.logger.error("Error handling client: %s", e)
 
-            # クライアント切断時にリストから削除
+            # クライアント切断時にリストと購読中のルームから削除
         finally:
-            if client in self.clients:
-                self.clients.remove(client)
-            client.close()
-            self.logger.info("Client disconnected.")
-
-    async def route_request(self, action, request):
-        """Route client actions to the appropriate database methods."""
-        if action == "add_user":
-            username = request.get("username")
-            password = request.get("password")
-            return await self.db.add_user(username, password)
-
-        elif action == "login":
-            username = request.get("username")
-            password = request.get("password")
-            login_result = await self.db.login(username, password)
-
-            if login_result["status"] == "success":
-                self.logger.info(f"User {username} logged in.")
-                user_id = login_result["user_id"]
-                session_id = self.create_session(user_id)
-                return {"status": "success", "session_id": session_id}
-            else:
-                return login_result
-
-        elif action == "get_rooms_by_user":
-            self.logger.debug("get_rooms_by_user")
-            user_id = request.get("user_id")
-            return await self.db.get_rooms_by_user(user_id)
-
-        elif action == "get_messages_by_room":
-            room_id = request.get("room_id")
-            return await self.db.get_messages_by_room(room_id)
-
-        elif action == "add_message":
-            session_id = request.get("session_id")
-            room_id = request.get("room_id")
-            message = request.get("message")
-
-            user_id = self.validate_session(session_id)
-            if not user_id:
-                return {"status": "error", "message": "Invalid or expired session"}
-
-            save_result = await self.db.save_message_async(user_id, room_id, message)
-
-            if save_result["status"] == "success":
-                self.logger.info(f"Message saved with ID: {save_result['message_id']}")
-                return {"status": "success", "message_id": save_result["message_id"]}
-            else:
-                self.logger.error(f"Error saving message: {save_result['message']}")
-                return {"status": "error", "message": save_result["message"]}
-
-        elif action == "create_room":
-            session_id = request.get("session_id")
-            room_name = request.get("room_name")
-
-            # 修正: セッションを適切に検証
-            user_id = self.validate_session(session_id)
-            if not user_id:
-                return {"status": "error", "message": "Invalid or expired session"}
-
-            create_room_result = await self.db.create_room_async(room_name)
-
-            if create_room_result["status"] == "success":
-                self.logger.info(
-                    f"Room created with ID: {create_room_result['room_id']}"
-                )
-                return {"status": "success", "room_id": create_room_result["room_id"]}
-            else:
-                self.logger.error(
-                    f"Error creating room: {create_room_result['message']}"
-                )
-
-                return {"status": "error", "message": create_room_result["message"]}
-
-        elif action == "join_room":
-            session_id = request.get("session_id")
-            room_name = request.get("room_name")
-
-            user_id = self.validate_session(session_id)
-            if not user_id:
-                return {"status": "error", "message": "Invalid or expired session"}
-
-            # ルーム名からルームIDを取得
-            room_id_result = await self.db.get_room_id_by_name(room_name)
-            if room_id_result["status"] != "success":
-                return {"status": "error", "message": "Room not found"}
-
-            room_id = room_id_result["room_id"]
-
-            # ユーザーをルームに追加
-            join_result = await self.db.add_user_to_room(user_id, room_id)
-            self.logger.debug(f"join_room: {join_result}")
-            if join_result["status"] == "success":
-                self.logger.info(
-                    f"User {user_id} joined room {room_name} (ID: {room_id})"
-                )
-                return {"status": "success", "room_id": room_id}
-            else:
-                self.logger.error(f"Error joining room: {join_result['message']}")
-                return {"status": "error", "message": join_result["message"]}
-
-        elif action == "leave_room":
-            session_id = request.get("session_id")
-            room_id = request.get("room_id")
-
-            user_id = self.validate_session(session_id)
-            if not user_id:
-                return {"status": "error", "message": "Invalid or expired session"}
-
-            leave_result = await self.db.remove_user_from_room(user_id, room_id)
+            # 切断前に受け付けたリクエスト(メッセージ保存など)は最後まで処理する
+            if inflight:
+                await asyncio.gather(*inflight, return_exceptions=True)
+            self.remove_client(client)
+            self.admission.close_connection(client)
+            await client.aclose()
+            if client.disconnected_slow:
+                self.logger.error("Disconnected slow client: %s", client.address)
+            self.logger.info(
+                "Client disconnected.", extra=log_extra(sample="client_disconnected")
+            )
+
+    async def send_response(self, client, response):
+        """Queue a framed JSON response for a single client."""
+        try:
+            await client.send(encode_message(response, client.codec))
+        except ConnectionError as e:
+            self.logger.error("Error sending data to client: %s", e)
+
+    async def process_request(self, client, request):
+        """Route a single decoded request and send the response."""
+        self.logger.debug("Received request: %s", request)
+
+        response = await self.admit_request(request.get("action"), request, client)
+        # 並行処理では返答の順序が入れ替わるため、クライアントが対応付けられるようにIDを返す
+        if "request_id" in request:
+            response["request_id"] = request["request_id"]
+
+        # 配信するメッセージはレスポンスの後に送る(クライアントは次のフレームを返答として読むため)
+        broadcasts = response.pop("_broadcast", ())
+        codec = response.pop("_codec", None)
+        compressor = response.pop("_compressor", None)
+
+        # クライアントへのレスポンス送信
+        await self.send_response(client, response)
+
+        # hello のレスポンスは交渉前の形式で送り、その後のフレームから切り替える
+        if codec is not None:
+            client.codec = codec
+        if compressor is not None:
+            client.set_compressor(compressor)
+
+        # メッセージが送信された場合、そのルームを購読しているクライアントにのみ送信
+        for room_id, message_data in broadcasts:
+            await self.broadcast_to_room(room_id, message_data)
+            self.logger.debug("Broadcasted message to room: %s", room_id)
+            self.logger.debug("Broadcasted message: %s", message_data)
+
+    async def process_concurrent(self, client, request, slots):
+        """Process a request that carries a request_id alongside others on the same connection."""
+        try:
+            await self.process_request(client, request)
+        except Exception as e:
+            self.logger.error(
+                "Error processing request %s: %s", request["request_id"], e
+            )
+            await self.send_response(
+                client,
+                {
+                    "status": "error",
+                    "message": str(e),
+                    "request_id": request["request_id"],
+                },
+            )
+        finally:
+            slots.release()
 
-            if leave_result["status"] == "success":
-                self.logger.info(f"User {user_id} left room {room_id}")
-                return {"status": "success"}
-            else:
-                return {"status": "error", "message": leave_result["message"]}
+    async def admit_request(self, action, request, client=None):
+        """
+        Route a request if the admission controller accepts it.
+        batch のサブリクエストも1件ずつここを通し、IPごとのレートと同時処理数に数える
+        """
+        # 同時処理数が上限に達している場合は、処理せずに busy を返す(負荷の遮断)
+        response = self.admission.begin_request(client)
+        if response is not None:
+            # クライアントが送った任意の文字列をラベルにすると系列が際限なく増えるため、未知のアクションはまとめる
+            label = action if action in self.actions else "unknown"
+            self.metrics.inc("rejected", action=label, status=response["status"])
+            return response
+        try:
+            return await self.route_request(action, request, client)
+        finally:
+            self.admission.end_request()
 
-        elif action == "get_users_in_room":
-            room_id = request.get("room_id")
-            users_result = await self.db.get_users_in_room(room_id)
+    async def route_request(self, action, request, client=None):
+        """
+        Route client actions to the registered handler.
+        param client: リクエスト元の接続。ルームの購読登録に使用する
+        """
+        return await self.actions.dispatch(action, request, client)
 
-            if users_result["status"] == "success":
-                self.logger.info(f"Retrieved users for room {room_id}")
-                return {"status": "success", "user_ids": users_result["user_ids"]}
-            else:
-                return {"status": "error", "message": users_result["message"]}
+    def _record_request(self, action, elapsed, response):
+        self.metrics.inc("requests", action=action)
+        if response.get("status") == "error":
+            self.metrics.inc("errors", action=action)
+        self.metrics.observe_seconds("request_seconds", elapsed, action=action)
 
+    @action("hello")
+    async def handle_hello(self, ctx):
+        """
+        Negotiate the wire encoding for the rest of the connection.
+        codecs はクライアントが使えるコーデック名を優先順に並べたリスト
+        compression に "zlib" を指定すると、サーバーからのフレームを圧縮して送る
+        """
+        if ctx.client is None:
+            return {"status": "error", "message": "No connection to negotiate"}
+        codec = negotiate(ctx.get("codecs"))
+        self.logger.debug("Negotiated codec %s for %s", codec.name, ctx.client.address)
+        response = {
+            "status": "success",
+            "codec": codec.name,
+            "codecs": list(CODECS),
+            "compression": None,
+            "_codec": codec,
+        }
+        # 圧縮の途中で切り替えると展開側のコンテキストと食い違うため、一度有効にしたら変えない
+        if ctx.client.compressor is not None:
+            response["compression"] = COMPRESSIONS[0]
+        elif ctx.get("compression") in COMPRESSIONS:
+            response["compression"] = ctx.get("compression")
+            response["compression_threshold"] = self.compression_threshold
+            response["_compressor"] = FrameCompressor(self.compression_threshold)
+        return response
+
+    @action("add_user", fields=("username", "password"))
+    async def handle_add_user(self, ctx):
+        return await self.db.add_user(ctx.get("username"), ctx.get("password"))
+
+    @action("login", fields=("username", "password"))
+    async def handle_login(self, ctx):
+        username = ctx.get("username")
+        login_result = await self.db.login(username, ctx.get("password"))
+        if login_result["status"] != "success":
+            return login_result
+
+        self.logger.info("User %s logged in.", username)
+        session_id = self.create_session(login_result["user_id"])
+        # 他のプロセスで検証される前にDBへの保存を終えておく
+        if self.sessions.backend is not None:
+            await self.sessions.flush()
+        return {"status": "success", "session_id": session_id}
+
+    @action("get_rooms_by_user", fields=("user_id",))
+    async def handle_get_rooms_by_user(self, ctx):
+        return await self.db.get_rooms_by_user(ctx.get("user_id"))
+
+    @action("get_messages_by_room", fields=("room_id",))
+    async def handle_get_messages_by_room(self, ctx):
+        # room_id・before_id・after_id・limit はレジストリで int に変換済み
+        return await self.db.get_messages_by_room(
+            ctx.get("room_id"),
+            before_id=ctx.get("before_id"),
+            after_id=ctx.get("after_id"),
+            limit=ctx.get("limit"),
+        )
+
+    @action("add_message", auth=True, fields=("room_id", "message"), limited=True)
+    async def handle_add_message(self, ctx):
+        room_id = ctx.get("room_id")
+        message = ctx.get("message")
+        save_result = await self.db.save_message_async(ctx.user_id, room_id, message)
+        if save_result["status"] != "success":
+            self.logger.error("Error saving message: %s", save_result["message"])
+            return {"status": "error", "message": save_result["message"]}
+
+        self.logger.info(
+            "Message saved with ID: %s",
+            save_result["message_id"],
+            extra=log_extra(
+                sample="message_saved",
+                message_id=save_result["message_id"],
+                room_id=room_id,
+            ),
+        )
+        # ユーザー名はキャッシュから引くため、配信時にDBへの問い合わせは発生しない
+        user_name_result = await self.db.get_username_by_user_id(ctx.user_id)
+        message_data = {
+            "action": "new_message",
+            "message_id": save_result["message_id"],
+            "message": message,
+            "room_id": room_id,
+            "user_name": user_name_result.get("username"),
+        }
+        return {
+            "status": "success",
+            "message_id": save_result["message_id"],
+            "_broadcast": [(room_id, message_data)],
+        }
+
+    @action("create_room", auth=True, fields=("room_name",), limited=True)
+    async def handle_create_room(self, ctx):
+        create_room_result = await self.db.create_room_async(ctx.get("room_name"))
+        if create_room_result["status"] != "success":
+            self.logger.error("Error creating room: %s", create_room_result["message"])
+            return {"status": "error", "message": create_room_result["message"]}
+
+        room_id = create_room_result["room_id"]
+        self.logger.info("Room created with ID: %s", room_id)
+        # 作成者はそのままルームのメッセージを受信する
+        if ctx.client is not None:
+            self.add_client_to_room(room_id, ctx.client)
+        return {"status": "success", "room_id": room_id}
+
+    @action("join_room", auth=True, fields=("room_name",), limited=True)
+    async def handle_join_room(self, ctx):
+        room_name = ctx.get("room_name")
+        # ルーム名からルームIDを取得
+        room_id_result = await self.db.get_room_id_by_name(room_name)
+        if room_id_result["status"] != "success":
+            return {"status": "error", "message": "Room not found"}
+        room_id = room_id_result["room_id"]
+
+        # ユーザーをルームに追加
+        join_result = await self.db.add_user_to_room(ctx.user_id, room_id)
+        self.logger.debug("join_room: %s", join_result)
+        if join_result["status"] != "success":
+            self.logger.error("Error joining room: %s", join_result["message"])
+            return {"status": "error", "message": join_result["message"]}
+
+        self.logger.info(
+            "User %s joined room %s (ID: %s)", ctx.user_id, room_name, room_id
+        )
+        if ctx.client is not None:
+            self.add_client_to_room(room_id, ctx.client)
+        return {"status": "success", "room_id": room_id}
+
+    @action("leave_room", auth=True, fields=("room_id",))
+    async def handle_leave_room(self, ctx):
+        room_id = ctx.get("room_id")
+        leave_result = await self.db.remove_user_from_room(ctx.user_id, room_id)
+        if leave_result["status"] != "success":
+            return {"status": "error", "message": leave_result["message"]}
+
+        self.logger.info("User %s left room %s", ctx.user_id, room_id)
+        if ctx.client is not None:
+            self.remove_client_from_room(room_id, ctx.client)
+        return {"status": "success"}
+
+    @action("subscribe", auth=True, fields=("room_id",))
+    async def handle_subscribe(self, ctx):
+        # DBの参加状態は変えずに、この接続へのプッシュ通知のみを切り替える
+        if ctx.client is None:
+            return {"status": "error", "message": "No connection to subscribe"}
+        self.add_client_to_room(ctx.get("room_id"), ctx.client)
+        return {"status": "success", "room_id": ctx.get("room_id")}
+
+    @action("unsubscribe", auth=True, fields=("room_id",))
+    async def handle_unsubscribe(self, ctx):
+        if ctx.client is None:
+            return {"status": "error", "message": "No connection to subscribe"}
+        self.remove_client_from_room(ctx.get("room_id"), ctx.client)
+        return {"status": "success", "room_id": ctx.get("room_id")}
+
+    @action("batch", fields=("requests",))
+    async def handle_batch(self, ctx):
+        """
+        Run several sub-requests in one round trip and return their responses in order.
+        parallel が真の場合はサブリクエストを並行に実行し、それ以外は先頭から順に実行する。
+        session_id を省略したサブリクエストには batch の session_id を使う。
+        """
+        requests = ctx.get("requests")
+        if not isinstance(requests, list) or not all(
+            isinstance(request, dict) for request in requests
+        ):
+            return {"status": "error", "message": "requests must be a list of objects"}
+        if len(requests) > MAX_BATCH_REQUESTS:
+            return {
+                "status": "error",
+                "message": f"A batch may contain at most {MAX_BATCH_REQUESTS} requests",
+            }
+
+        session_id = ctx.get("session_id")
+
+        async def run(request):
+            action_name = request.get("action")
+            if action_name in NOT_BATCHABLE_ACTIONS:
+                return {
+                    "status": "error",
+                    "message": f"{action_name} is not allowed in a batch",
+                }
+            if session_id is not None and "session_id" not in request:
+                request = {**request, "session_id": session_id}
+            return await self.admit_request(action_name, request, ctx.client)
+
+        if ctx.get("parallel"):
+            responses = list(await asyncio.gather(*(run(r) for r in requests)))
+        else:
+            responses = [await run(request) for request in requests]
+
+        # サブリクエストの配信はまとめて batch のレスポンスの後に送る
+        broadcasts = []
+        for response in responses:
+            broadcasts.extend(response.pop("_broadcast", ()))
+        return {"status": "success", "responses": responses, "_broadcast": broadcasts}
+
+    @action("stats")
+    async def handle_stats(self, ctx):
+        """Return request counters, latency histograms and gauges."""
+        return {"status": "success", **self.metrics.snapshot()}
+
+    @action("get_users_in_room", fields=("room_id",))
+    async def handle_get_users_in_room(self, ctx):
+        room_id = ctx.get("room_id")
+        users_result = await self.db.get_users_in_room(room_id)
+        if users_result["status"] != "success":
+            return {"status": "error", "message": users_result["message"]}
+
+        self.logger.info(
+            "Retrieved users for room %s",
+            room_id,
+            extra=log_extra(sample="users_retrieved"),
+        )
+        return {"status": "success", "user_ids": users_result["user_ids"]}
+
+    async def broadcast_message(self, message_data):
+        """Queue a message for every connected client without waiting for the writes."""
+        await self.broadcaster.publish(None, message_data)
+
+    async def broadcast_to_room(self, room_id, message_data):
+        """Queue a message for all clients in a specific room."""
+        await self.broadcaster.publish(room_id, message_data)
+
+    async def _deliver_local(self, room_id, message_data):
+        """Queue a message for this server's connections (called by the broadcast backend)."""
+        subscribers = self.clients if room_id is None else self.room_clients.get(room_id)
+        if not subscribers:
+            return
+        started = time.perf_counter()
+        self._enqueue_encoded(subscribers, message_data)
+        self.metrics.observe_seconds("broadcast_seconds", time.perf_counter() - started)
+        self.metrics.observe("broadcast_fanout", len(subscribers))
+
+    def _room_updated(self, room_id, message_id):
+        # 他のプロセスやノードで保存されたメッセージは、このプロセスの最新メッセージのキャッシュにない
+        if room_id is None:
+            self.db.recent_messages.clear()
         else:
-            return {"status": "error", "message": "Unknown action"}
-
-    async def broadcast_message(self, message_data, loop):
-        for client in self.clients:
-            try:
-                await loop.sock_sendall(client, message_data.encode())
-            except (BrokenPipeError, ConnectionResetError) as e:
-                self.logger.error(f"Error broadcasting message to client: {e}")
-                self.clients.remove(client)
-
-    async def broadcast_to_room(self, room_id, message_data, loop):
-        """Send a message to all clients in a specific room."""
-        if room_id in self.room_clients:
-            for client in self.room_clients[room_id]:
-                try:
-                    await loop.sock_sendall(client, message_data.encode())
-                except (BrokenPipeError, ConnectionResetError) as e:
-                    self.logger.error(
-                        f"Error broadcasting message to client in room {room_id}: {e}"
-                    )
-                    self.remove_client_from_room(client, room_id)
+            self.db.recent_messages.invalidate(room_id, message_id)
+
+    @staticmethod
+    def _enqueue_encoded(clients, message_data):
+        # エンコードとフレーム化はコーデックごとに1回だけ行い、同じ bytes を各キューに渡す
+        frames = {}
+        for client in clients:
+            frame = frames.get(client.codec)
+            if frame is None:
+                frame = frames[client.codec] = encode_message(message_data, client.codec)
+            client.enqueue(frame)
+
+    def send_queue_stats(self):
+        """Summarize send queue depth across all connections."""
+        depths = [client.queue_depth for client in self.clients]
+        return {
+            "clients": len(depths),
+            "total_queue_depth": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "peak_queue_depth": max(
+                (client.peak_queue_depth for client in self.clients), default=0
+            ),
+            "dropped_frames": sum(client.dropped_frames for client in self.clients),
+            "coalesced_frames": sum(
+                client.coalesced_frames for client in self.clients
+            ),
+        }
 
 
 if __name__ == "__main__":
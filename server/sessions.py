@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import time
+
+from utils import generate_session_id
+
+# セッションの有効期間(秒)。操作があるたびにこの長さだけ延長する
+DEFAULT_SESSION_TTL = 3600
+# 同時に保持するセッション数の上限
+DEFAULT_MAX_SESSIONS = 100000
+# 期限切れセッションを掃除する間隔(秒)
+DEFAULT_SWEEP_INTERVAL = 60
+
+
+class Session:
+    __slots__ = ("session_id", "user_id", "expires_at", "persisted_until")
+
+    def __init__(self, session_id, user_id, expires_at):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.expires_at = expires_at
+        self.persisted_until = expires_at  # バックエンドに保存済みの有効期限
+
+
+class SessionStore:
+    """
+    In-memory sessions with sliding expiry and a bounded size.
+    有効期限は (expires_at, session_id) のヒープで管理する。延長時にはヒープを更新せず、
+    取り出したときに期限が延びていれば入れ直すため、検証は O(1)、掃除は期限切れの件数分で済む。
+
+    backend を指定すると、セッションを永続化してメモリ上の内容をそのキャッシュとして扱う。
+    保存はバックグラウンドで行い、メモリにないセッションは検証時に初めて読み込む。
+    そのため再起動後も全員が再ログインする必要はなく、上限で追い出したセッションも有効なまま残る。
+    """
+
+    def __init__(
+        self,
+        ttl=DEFAULT_SESSION_TTL,
+        max_sessions=DEFAULT_MAX_SESSIONS,
+        sweep_interval=DEFAULT_SWEEP_INTERVAL,
+        logger=None,
+        backend=None,
+    ):
+        """
+        param backend: load_session / save_session_async / delete_session_async /
+            delete_expired_sessions_async を持つオブジェクト(AsyncDatabase)
+        """
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self.logger = logger
+        self._sessions = {}  # session_id -> Session
+        self._expiry = []  # (期限の下限, session_id) のヒープ
+        self._task = None
+        self.backend = backend
+        self._loading = {}  # session_id -> 読み込み中の Future(同じIDの読み込みを1回にまとめる)
+        self._writes = set()
+
+        self.created = 0
+        self.loaded = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def create(self, user_id):
+        """Create a session for user_id and return its ID."""
+        now = time.time()
+        if len(self._sessions) >= self.max_sessions:
+            self.sweep(now)
+            # 期限切れがなければ、最も早く期限を迎えるセッションを追い出す
+            while len(self._sessions) >= self.max_sessions and self._pop_next(None):
+                self.evicted += 1
+
+        session_id = generate_session_id(user_id)
+        session = Session(session_id, user_id, now + self.ttl)
+        self._add(session)
+        self.created += 1
+        self._persist(session)
+        return session_id
+
+    def _add(self, session):
+        self._sessions[session.session_id] = session
+        heapq.heappush(self._expiry, (session.expires_at, session.session_id))
+
+    async def validate(self, session_id):
+        """
+        Return the user ID of a live session and extend its expiry, or None.
+        期限切れのセッションはその場で削除する
+        """
+        session = self._sessions.get(session_id)
+        if session is None:
+            if self.backend is None or not session_id:
+                return None
+            session = await self._load(session_id)
+            if session is None:
+                return None
+        now = time.time()
+        if now >= session.expires_at:
+            self._sessions.pop(session_id, None)
+            # 他のプロセスが延長している可能性があるため、バックエンドを確認する
+            if self.backend is not None:
+                session = await self._load(session_id)
+            if session is None or now >= session.expires_at:
+                self.expired += 1
+                return None
+        session.expires_at = now + self.ttl
+        # 延長のたびには書き込まず、保存済みの期限が半分を過ぎたら更新する
+        if session.expires_at - session.persisted_until > self.ttl / 2:
+            self._persist(session)
+        return session.user_id
+
+    async def _load(self, session_id):
+        """Read a session from the backend, sharing one read among concurrent callers."""
+        future = self._loading.get(session_id)
+        if future is not None:
+            return await future
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[session_id] = future
+        session = None
+        try:
+            result = await self.backend.load_session(session_id)
+            row = result.get("session")
+            # 読み込み中に同じIDが作成されていればそちらを優先する
+            session = self._sessions.get(session_id)
+            if session is None and row is not None and row[1] > time.time():
+                session = Session(session_id, row[0], row[1])
+                self._add(session)
+                self.loaded += 1
+        finally:
+            del self._loading[session_id]
+            future.set_result(session)
+        return session
+
+    def _persist(self, session):
+        if self.backend is None:
+            return
+        session.persisted_until = session.expires_at
+        self._spawn(
+            self.backend.save_session_async(
+                session.session_id, session.user_id, session.expires_at
+            )
+        )
+
+    def _spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    def remove(self, session_id):
+        """Forget a session (e.g. on logout). Its heap entry is skipped when popped."""
+        if self.backend is not None:
+            self._spawn(self.backend.delete_session_async(session_id))
+        return self._sessions.pop(session_id, None) is not None
+
+    def _pop_next(self, deadline):
+        """
+        Remove the session that expires first, if it expires before deadline.
+        param deadline: None の場合は期限に関係なく取り出す
+        return: セッションを削除した場合は True
+        """
+        while self._expiry:
+            expires_at, session_id = self._expiry[0]
+            if deadline is not None and expires_at > deadline:
+                return False
+            heapq.heappop(self._expiry)
+            session = self._sessions.get(session_id)
+            if session is None:
+                continue  # 削除済み
+            if session.expires_at > expires_at:
+                # 検証で延長されている。新しい期限で入れ直す
+                heapq.heappush(self._expiry, (session.expires_at, session_id))
+                continue
+            del self._sessions[session_id]
+            return True
+        return False
+
+    def sweep(self, now=None):
+        """Remove every session that has expired. Return how many were removed."""
+        now = time.time() if now is None else now
+        removed = 0
+        while self._pop_next(now):
+            removed += 1
+        self.expired += removed
+        return removed
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        """Wait for background writes to the backend."""
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if self.backend is not None:
+                await self.backend.delete_expired_sessions_async(time.time())
+            if removed and self.logger is not None:
+                self.logger.info("Expired %s sessions (%s active)", removed, len(self))
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "heap_entries": len(self._expiry),
+            "created": self.created,
+            "loaded": self.loaded,
+            "pending_writes": len(self._writes),
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# サーバーのモジュールは server/ をカレントディレクトリとして import される
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from codec import JSON
+from protocol import encode_message
+from server import ChatServer
+
+
+class FakeClient:
+    """Stand-in for ClientConnection with the attributes the handlers read."""
+
+    def __init__(self):
+        self.address = ("127.0.0.1", 50000)
+        self.codec = JSON
+        self.compressor = None
+        self.rooms = set()
+
+
+@pytest.fixture
+def chat_server(tmp_path):
+    server = ChatServer(db_name=str(tmp_path / "chat.db"))
+    yield server
+    server.db.close()
+
+
+@pytest.mark.parametrize("action", ["hello", "batch"])
+def test_batch_rejects_actions_that_change_the_connection(chat_server, action):
+    client = FakeClient()
+    request = {
+        "action": "batch",
+        "requests": [{"action": action, "codecs": ["json"], "compression": "zlib"}],
+    }
+    response = asyncio.run(chat_server.route_request("batch", request, client))
+
+    assert response["status"] == "success"
+    assert response["responses"] == [
+        {"status": "error", "message": f"{action} is not allowed in a batch"}
+    ]
+    assert client.compressor is None
+    # 内部用の値(_codec など)が残っているとエンコードに失敗する
+    response.pop("_broadcast")
+    encode_message(response, client.codec)
+
+
+def test_batch_sub_requests_take_ip_rate_tokens(tmp_path):
+    server = ChatServer(
+        db_name=str(tmp_path / "chat.db"), ip_rate_limit=0.001, ip_rate_limit_burst=3
+    )
+    try:
+        request = {"action": "batch", "requests": [{"action": "stats"}] * 5}
+        response = asyncio.run(server.route_request("batch", request, FakeClient()))
+    finally:
+        server.db.close()
+
+    statuses = [sub["status"] for sub in response["responses"]]
+    assert statuses == ["success"] * 3 + ["error"] * 2
+    assert response["responses"][-1]["message"] == "Rate limit exceeded"
+
+
+def test_batch_sub_requests_count_against_inflight_cap(chat_server):
+    admission = chat_server.admission
+    admission.inflight = admission.max_inflight_total
+    request = {
+        "action": "batch",
+        "parallel": True,
+        "requests": [{"action": "stats"}] * 4,
+    }
+    response = asyncio.run(chat_server.route_request("batch", request, FakeClient()))
+
+    assert [sub["status"] for sub in response["responses"]] == ["busy"] * 4
+    assert admission.shed == 4
+    assert admission.inflight == admission.max_inflight_total
+
+
+def test_rejected_requests_are_labelled_with_known_actions_only(chat_server):
+    chat_server.admission.inflight = chat_server.admission.max_inflight_total
+    client = FakeClient()
+
+    async def run():
+        for action in ["stats", "no-such-action", 'x"}\n', ["stats"], {"a": 1}]:
+            response = await chat_server.admit_request(action, {}, client)
+            assert response["status"] == "busy"
+
+    asyncio.run(run())
+
+    labels = sorted(
+        dict(key)["action"] for key in chat_server.metrics.counters["rejected"]
+    )
+    assert labels == ["stats", "unknown"]
@@ -0,0 +1,123 @@
+import asyncio
+import functools
+
+from broadcast import BrokerBackend, FanoutBusBackend
+from broker import Broker
+from bus import BusClient, FanoutHub
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_clients_reconnect_after_the_hub_restarts(tmp_path):
+    path = str(tmp_path / "bus.sock")
+
+    async def run():
+        received = []
+        connects = []
+
+        async def on_message(message):
+            received.append(message)
+
+        hub = FanoutHub(path)
+        await hub.start()
+        open_connection = functools.partial(asyncio.open_unix_connection, path)
+        sender = BusClient(open_connection, on_message)
+        receiver = BusClient(open_connection, on_message, on_connect=connects.append)
+        await sender.connect()
+        await receiver.connect()
+        try:
+            await wait_for(lambda: len(hub.peers) == 2)
+            sender.publish({"n": 1})
+            await wait_for(lambda: len(received) == 1)
+
+            await hub.stop()
+            await wait_for(lambda: receiver.connection is None)
+            hub = FanoutHub(path)
+            await hub.start()
+            await wait_for(lambda: len(hub.peers) == 2)
+            sender.publish({"n": 2})
+            await wait_for(lambda: len(received) == 2)
+        finally:
+            await sender.close()
+            await receiver.close()
+            await hub.stop()
+        return received, connects, receiver.stats()
+
+    received, connects, stats = asyncio.run(run())
+
+    assert received == [{"n": 1}, {"n": 2}]
+    # 再接続のたびに on_connect が呼ばれる
+    assert connects == [False, True]
+    assert stats["reconnects"] == 1
+    assert stats["connected"] == 1
+
+
+def test_backend_forgets_cached_rooms_after_reconnecting(tmp_path):
+    path = str(tmp_path / "bus.sock")
+
+    async def run():
+        updates = []
+
+        async def deliver(room_id, message_data):
+            pass
+
+        hub = FanoutHub(path)
+        await hub.start()
+        backend = FanoutBusBackend(path)
+        backend.bind(deliver, lambda *update: updates.append(update))
+        await backend.start()
+        try:
+            await wait_for(lambda: len(hub.peers) == 1)
+            await hub.stop()
+            hub = FanoutHub(path)
+            await hub.start()
+            await wait_for(lambda: backend.client.reconnects == 1)
+        finally:
+            await backend.close()
+            await hub.stop()
+        return updates
+
+    # 切断中の更新はどのルームのものか分からないため、すべてのルームを破棄させる
+    assert asyncio.run(run()) == [(None, None)]
+
+
+def test_broker_subscriptions_are_sent_again_after_reconnecting():
+    async def run():
+        delivered = []
+
+        async def deliver(room_id, message_data):
+            delivered.append((room_id, message_data))
+
+        async def ignore(room_id, message_data):
+            pass
+
+        broker = Broker(port=0)
+        await broker.start()
+        port = broker.server.sockets[0].getsockname()[1]
+        subscriber = BrokerBackend("127.0.0.1", port)
+        subscriber.bind(deliver, lambda *update: None)
+        publisher = BrokerBackend("127.0.0.1", port)
+        publisher.bind(ignore, lambda *update: None)
+        await subscriber.start()
+        await publisher.start()
+        subscriber.subscribe(1)
+        try:
+            await wait_for(lambda: 1 in broker.topics and len(broker.nodes) == 2)
+            await broker.stop()
+            broker = Broker(port=port)
+            await broker.start()
+            await wait_for(lambda: 1 in broker.topics and len(broker.nodes) == 2)
+            await publisher.publish(1, {"message_id": 7, "message": "hello"})
+            await wait_for(lambda: delivered)
+        finally:
+            await subscriber.close()
+            await publisher.close()
+            await broker.stop()
+        return delivered
+
+    assert asyncio.run(run()) == [(1, {"message_id": 7, "message": "hello"})]
@@ -0,0 +1,55 @@
+import asyncio
+
+from database import AsyncDatabase
+
+
+def test_failed_row_in_a_batch_does_not_leave_a_transaction_open(tmp_path):
+    async def run():
+        db = AsyncDatabase(str(tmp_path / "chat.db"))
+        try:
+            await db.setup_database()
+            # 範囲外の room_id は executemany の途中で OverflowError になる
+            results = await asyncio.gather(
+                db.save_message_async(1, 1, "good-before"),
+                db.save_message_async(1, 10**30, "bad"),
+                db.save_message_async(1, 2, "good-after"),
+            )
+            later = await db.save_message_async(1, 1, "later")
+            page = await db.get_messages_by_room(1)
+            return results, later, page
+        finally:
+            await db.flush()
+            db.close()
+
+    results, later, page = asyncio.run(run())
+
+    assert [result["status"] for result in results] == ["success", "error", "success"]
+    assert later["status"] == "success"
+    assert [message["message"] for message in page["messages"]] == [
+        "good-before",
+        "later",
+    ]
+    assert page["messages"][0]["message_id"] == results[0]["message_id"]
+
+
+def test_login_verifies_a_password_for_unknown_users(tmp_path):
+    async def run():
+        db = AsyncDatabase(str(tmp_path / "chat.db"), hash_workers=1)
+        try:
+            await db.setup_database()
+            await db.add_user("alice", "secret")
+            verified = db.password_hasher.verified
+            unknown = await db.login("mallory", "secret")
+            wrong = await db.login("alice", "wrong")
+            return unknown, wrong, db.password_hasher.verified - verified
+        finally:
+            db.close()
+
+    unknown, wrong, verified = asyncio.run(run())
+
+    assert unknown == wrong == {
+        "status": "error",
+        "message": "Invalid username or password",
+    }
+    # 存在しないユーザーでもハッシュの検証を1回行う
+    assert verified == 2
@@ -0,0 +1,55 @@
+from history_cache import RecentMessageCache
+
+
+def make_message(message_id):
+    return {
+        "message_id": message_id,
+        "user_id": 1,
+        "message": f"message {message_id}",
+        "timestamp": "2024-01-01 00:00:00",
+    }
+
+
+def message_ids(page):
+    return [message["message_id"] for message in page["messages"]]
+
+
+def test_append_after_seed_that_already_read_the_message():
+    # 保存のコミット後・append の前に seed がDBを読むと、同じメッセージが2回届く
+    cache = RecentMessageCache(messages_per_room=10)
+    cache.append(1, make_message(3020))
+    assert cache.seed(1, [make_message(3020), make_message(3021)], has_older=False)
+    cache.append(1, make_message(3021))
+    cache.append(1, make_message(3022))
+
+    assert message_ids(cache.latest(1, 10)) == [3020, 3021, 3022]
+    assert cache.stats()["messages"] == 3
+
+
+def test_append_skips_older_message_ids():
+    cache = RecentMessageCache(messages_per_room=10)
+    cache.seed(1, [make_message(1), make_message(2), make_message(3)], has_older=False)
+    size = cache.total_bytes
+    cache.append(1, make_message(2))
+
+    assert message_ids(cache.latest(1, 10)) == [1, 2, 3]
+    assert cache.total_bytes == size
+
+
+def test_seed_is_rejected_when_it_misses_an_appended_message():
+    cache = RecentMessageCache(messages_per_room=10)
+    cache.append(1, make_message(5))
+
+    assert not cache.seed(1, [make_message(4)], has_older=False)
+    assert cache.latest(1, 10) is None
+
+
+def test_last_saved_ids_are_bounded():
+    cache = RecentMessageCache(messages_per_room=10, max_tracked_rooms=3)
+    for room_id in range(100):
+        cache.append(room_id, make_message(room_id + 1))
+    cache.invalidate(1000, 200)
+
+    assert cache.stats()["tracked_rooms"] == 3
+    # 最近保存のあったルームでは、古い seed を引き続き拒否する
+    assert not cache.seed(99, [make_message(50)], has_older=False)
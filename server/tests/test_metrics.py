@@ -0,0 +1,13 @@
+from metrics import Metrics
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.inc("requests", action='a"b\\c\nchat_fake_total 1')
+
+    lines = metrics.render_text().splitlines()
+
+    assert lines == [
+        "# TYPE chat_requests_total counter",
+        'chat_requests_total{action="a\\"b\\\\c\\nchat_fake_total 1"} 1',
+    ]
@@ -0,0 +1,9 @@
+import pytest
+
+from passwords import SCHEME_PBKDF2, SCHEME_SCRYPT, dummy_hash, verify_password
+
+
+@pytest.mark.parametrize("scheme", [SCHEME_SCRYPT, SCHEME_PBKDF2])
+def test_dummy_hash_never_matches(scheme):
+    assert verify_password("", dummy_hash(scheme), scheme) == (False, False)
+    assert verify_password("password", dummy_hash(scheme), scheme) == (False, False)
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from registry import ActionRegistry
+
+
+async def no_session(session_id):
+    return None
+
+
+def dispatch(registry, action, request):
+    return asyncio.run(registry.dispatch(action, {"action": action, **request}))
+
+
+@pytest.fixture
+def registry():
+    registry = ActionRegistry(no_session)
+
+    async def echo(ctx):
+        return {"status": "success", "room_id": ctx.get("room_id")}
+
+    registry.register("echo", echo, fields=("room_id",))
+    return registry
+
+
+@pytest.mark.parametrize("room_id", [1, "1", 1.0])
+def test_integer_fields_are_converted(registry, room_id):
+    assert dispatch(registry, "echo", {"room_id": room_id}) == {
+        "status": "success",
+        "room_id": 1,
+    }
+
+
+@pytest.mark.parametrize(
+    "room_id", ["x", 1.5, True, [1], 2**63, -(2**63) - 1, float("inf")]
+)
+def test_invalid_integer_fields_are_rejected(registry, room_id):
+    assert dispatch(registry, "echo", {"room_id": room_id}) == {
+        "status": "error",
+        "message": "room_id must be an integer",
+    }
+
+
+@pytest.mark.parametrize("action", ["missing", None, 1, ["echo"], {"name": "echo"}])
+def test_unknown_actions(registry, action):
+    response = asyncio.run(registry.dispatch(action, {"action": action}))
+
+    assert response == {"status": "error", "message": "Unknown action"}
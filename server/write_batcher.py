@@ -0,0 +1,93 @@
+import asyncio
+
+# 1回のトランザクションにまとめる最大件数
+DEFAULT_MAX_BATCH_SIZE = 256
+# 最初の1件が届いてからコミットするまでに待つ最大秒数
+DEFAULT_MAX_DELAY = 0.005
+
+
+class WriteBatcher:
+    """
+    Group-commit batcher for inserts issued concurrently on the event loop.
+    短い時間窓に届いた書き込みをまとめ、書き込みスレッドで1回のトランザクションとしてコミットする。
+    呼び出し元はそれぞれ自分の行の結果を受け取る。
+    """
+
+    def __init__(
+        self,
+        executor,
+        insert_batch,
+        max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+        max_delay=DEFAULT_MAX_DELAY,
+    ):
+        """
+        param executor: DatabaseExecutor
+        param insert_batch: insert_batch(connection, rows) -> 行ごとの結果のリスト
+        param max_batch_size: この件数に達したら時間窓を待たずにコミットする
+        param max_delay: 最初の1件がコミットを待つ最大秒数(レイテンシの上限)
+        """
+        self.executor = executor
+        self.insert_batch = insert_batch
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._pending = []  # (row, future) のリスト
+        self._timer = None
+        self._inflight = set()
+
+        self.batches = 0
+        self.rows = 0
+        self.largest_batch = 0
+
+    async def submit(self, row):
+        """Queue one row and wait for the result of the batch it was committed in."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush_pending)
+        return await future
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._commit(batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _commit(self, batch):
+        rows = [row for row, _ in batch]
+        try:
+            results = await self.executor.write(self.insert_batch, rows)
+        except Exception as e:
+            results = [{"status": "error", "message": str(e)}] * len(batch)
+
+        self.batches += 1
+        self.rows += len(batch)
+        if len(batch) > self.largest_batch:
+            self.largest_batch = len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def flush(self):
+        """Commit anything still waiting in the window and wait for in-flight batches."""
+        self._flush_pending()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "largest_batch": self.largest_batch,
+            "average_batch": round(self.rows / self.batches, 2) if self.batches else 0,
+            "pending": len(self._pending),
+        }
@@ -1,5 +1,6 @@
 import socket
 import json
+import struct
 
 client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 client_socket.connect(('127.0.0.1', 6001))
@@ -10,9 +11,11 @@ test_request = {
     "password": "1234"
 }
 
-client_socket.sendall(json.dumps(test_request).encode())
+payload = json.dumps(test_request).encode()
+client_socket.sendall(struct.pack("!I", len(payload)) + payload)
 
-response = client_socket.recv(1024)
-print("Response:", json.loads(response.decode()))
+reader = client_socket.makefile("rb")
+(length,) = struct.unpack("!I", reader.read(4))
+print("Response:", json.loads(reader.read(length).decode()))
 
 client_socket.close()